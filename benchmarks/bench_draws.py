@@ -0,0 +1,171 @@
+"""
+今日老婆抽取吞吐基准：在本地 Napcat 替身上运行 DailyWifePlugin，按群规模报告
+每秒抽取数、p50/p99 延迟以及每次操作写入磁盘的字节数。
+
+需要在装有 AstrBot 的环境中运行，不访问外网：
+    python benchmarks/bench_draws.py --sizes 50,500,5000 --latency-ms 5 --concurrency 20
+
+每个群规模都会把插件复制到独立的临时目录中加载，数据文件不会写进插件目录。
+JSON 后端统计实际写入的字节数；SQLite 由 C 库直接写文件，按运行结束时数据库文件（含 WAL）的大小计。
+"""
+import argparse
+import asyncio
+import builtins
+import contextlib
+import importlib.util
+import io
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from fake_napcat import FakeNapcat, member_ids
+
+PLUGIN_ROOT = Path(__file__).resolve().parent.parent
+GROUP_ID = 114514
+
+
+class FakeEvent:
+    """只实现插件命令用到的 AstrMessageEvent 接口"""
+    def __init__(self, group_id: int, user_id: int, text: str):
+        self.message_obj = SimpleNamespace(group_id=group_id, self_id="10000", raw_message=None)
+        self.message_str = text
+        self.session = f"bench:{group_id}"
+        self._user_id = str(user_id)
+
+    def get_sender_id(self):
+        return self._user_id
+
+    def get_sender_name(self):
+        return f"成员{self._user_id}"
+
+    def get_self_id(self):
+        return "10000"
+
+    def get_messages(self):
+        return []
+
+    def is_admin(self):
+        return False
+
+    def plain_result(self, text):
+        return text
+
+    def chain_result(self, chain):
+        return chain
+
+
+class WriteCounter:
+    """替换插件模块中的 open，统计写入数据文件的字节数"""
+    def __init__(self):
+        self.bytes = 0
+
+    def open(self, file, mode="r", *args, **kwargs):
+        f = builtins.open(file, mode, *args, **kwargs)
+        if any(flag in mode for flag in "wa"):
+            write = f.write
+
+            def counted(data):
+                self.bytes += len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+                return write(data)
+            f.write = counted
+        return f
+
+
+def load_plugin_module(workdir: Path):
+    """把 main.py 复制到临时目录后加载，插件的数据文件随之落在临时目录"""
+    shutil.copy(PLUGIN_ROOT / "main.py", workdir / "main.py")
+    spec = importlib.util.spec_from_file_location(f"daily_wife_bench_{workdir.name}", workdir / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sqlite_bytes(workdir: Path) -> int:
+    return sum(p.stat().st_size for p in workdir.glob("daily_wife.db*"))
+
+
+async def run_size(size: int, args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="dailywife_bench_"))
+    napcat = FakeNapcat({GROUP_ID: size}, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    await napcat.start()
+    try:
+        module = load_plugin_module(workdir)
+        counter = WriteCounter()
+        module.open = counter.open
+        config = {
+            "napcat_host": napcat.host,
+            "avatar_api_url": napcat.avatar_url,
+            "show_avatar": args.avatar,
+            "storage_backend": args.backend,
+            "persist_interval": args.persist_interval,
+            "max_daily_breakups": 3,
+            "breakup_block_hours": 24,
+        }
+        quiet = io.StringIO()
+        with contextlib.redirect_stdout(quiet):
+            plugin = module.DailyWifePlugin(SimpleNamespace(send_message=None), config)
+
+        users = member_ids(GROUP_ID, size)
+        random.Random(args.seed).shuffle(users)
+        queue = asyncio.Queue()
+        for uid in users:
+            queue.put_nowait(uid)
+        latencies = []
+
+        async def worker():
+            while not queue.empty():
+                uid = queue.get_nowait()
+                start = time.perf_counter()
+                async for _ in plugin.daily_wife_command(FakeEvent(GROUP_ID, uid, "今日老婆")):
+                    pass
+                latencies.append(time.perf_counter() - start)
+
+        with contextlib.redirect_stdout(quiet):
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+            await plugin.terminate()
+
+        latencies.sort()
+        written = counter.bytes + (sqlite_bytes(workdir) if args.backend == "sqlite" else 0)
+        return {
+            "size": size,
+            "ops": len(latencies),
+            "pairs": len(plugin.pair_data[str(GROUP_ID)].pairs) // 2,
+            "ops_per_sec": len(latencies) / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+            "bytes_per_op": written / len(latencies),
+            "napcat_requests": dict(napcat.requests),
+        }
+    finally:
+        await napcat.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def main(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"后端 {args.backend}，并发 {args.concurrency}，Napcat 延迟 {args.latency_ms}ms"
+          f"(+{args.jitter_ms}ms 抖动)，头像 {'开启' if args.avatar else '关闭'}")
+    print(f"{'群规模':>6} {'抽取次数':>8} {'成功配对':>8} {'抽取/秒':>10} {'p50(ms)':>9} {'p99(ms)':>9} {'字节/次':>9}  Napcat请求")
+    for size in sizes:
+        r = await run_size(size, args)
+        print(f"{r['size']:>9} {r['ops']:>12} {r['pairs']:>12} {r['ops_per_sec']:>13.0f} "
+              f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['bytes_per_op']:>11.0f}  {r['napcat_requests']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DailyWife 抽取吞吐基准")
+    parser.add_argument("--sizes", default="50,200,1000,5000", help="逗号分隔的群规模")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发发送命令的协程数")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Napcat 替身的固定响应延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="在固定延迟上叠加的随机抖动上限")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--persist-interval", type=float, default=0.5)
+    parser.add_argument("--avatar", action="store_true", help="开启头像（请求替身的头像接口）")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
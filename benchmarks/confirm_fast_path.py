@@ -0,0 +1,98 @@
+"""
+confirm_enable_advanced 每条消息开销的微基准。
+
+需要在装有 AstrBot 的环境中运行：
+    python benchmarks/confirm_fast_path.py [消息条数]
+"""
+import asyncio
+import importlib.util
+import sys
+import time
+from pathlib import Path
+
+PLUGIN_MAIN = Path(__file__).resolve().parent.parent / "main.py"
+CONFIRM_TEXT = "我已知晓进阶功能带来的潜在风险并且执意开启"
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location("daily_wife_main", PLUGIN_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.DailyWifePlugin
+
+
+class FakeSender:
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
+class FakeMessage:
+    def __init__(self, group_id, user_id):
+        self.group_id = group_id
+        self.sender = FakeSender(user_id)
+
+
+class FakeEvent:
+    """只实现 confirm_enable_advanced 用到的属性，取值方式与 AstrMessageEvent 相同"""
+    def __init__(self, group_id, user_id, text):
+        self.message_obj = FakeMessage(group_id, user_id)
+        self.message_str = text
+
+    def get_sender_id(self):
+        return str(self.message_obj.sender.user_id)
+
+
+async def legacy_confirm(states, event):
+    """优化前的处理逻辑：每条消息都取发送者、群号并比较消息文本"""
+    user_id = event.get_sender_id()
+    group_id = str(event.message_obj.group_id)
+    if (group_id, user_id) in states and event.message_str.strip() == CONFIRM_TEXT:
+        yield None
+
+
+async def noop(event):
+    """空处理函数，用于扣除异步生成器本身的开销"""
+    return
+    yield
+
+
+async def measure(handler, events, repeat: int = 5) -> float:
+    """多次运行取最快一次，返回每条消息的纳秒数"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            async for _ in handler(event):
+                pass
+        best = min(best, time.perf_counter() - start)
+    return best / len(events) * 1e9
+
+
+async def main(count: int):
+    plugin_cls = load_plugin()
+    states = plugin_cls.ADVANCED_ENABLE_STATES
+    events = [FakeEvent(10000 + i % 50, 20000 + i, "今天吃什么") for i in range(count)]
+    current = lambda event: plugin_cls.confirm_enable_advanced(None, event)
+    legacy = lambda event: legacy_confirm(states, event)
+
+    scenarios = [
+        ("无待确认请求", {}, {}),
+        ("其他群有待确认请求", {("1", "1"): {}}, {"1": 1}),
+        ("本群有待确认请求", {("10000", "1"): {}}, {"10000": 1}),
+    ]
+    base = await measure(noop, events)
+    print(f"每条消息平均耗时（{count} 条消息，已扣除空处理函数的 {base:.0f} ns）")
+    for name, pending_states, pending_groups in scenarios:
+        states.clear()
+        states.update(pending_states)
+        plugin_cls.ADVANCED_PENDING_GROUPS.clear()
+        plugin_cls.ADVANCED_PENDING_GROUPS.update(pending_groups)
+        before = await measure(legacy, events) - base
+        after = await measure(current, events) - base
+        print(f"  {name:<12} 优化前 {before:7.0f} ns   优化后 {after:7.0f} ns")
+    states.clear()
+    plugin_cls.ADVANCED_PENDING_GROUPS.clear()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000))
@@ -0,0 +1,85 @@
+"""
+本地 Napcat 替身：实现 get_group_member_list / get_group_member_info / get_status 以及头像接口，
+群规模与响应延迟可配置，成员数据按群号确定性生成，便于离线复现基准结果。
+"""
+import asyncio
+import random
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+AVATAR_BYTES = b"\x89PNG\r\n\x1a\n" + bytes(2048)
+
+
+def member_ids(group_id: int, size: int) -> List[int]:
+    """群成员 QQ 号：同一群号与规模总是得到相同结果"""
+    base = 10_000_000 + (group_id % 1000) * 100_000
+    return [base + i for i in range(size)]
+
+
+class FakeNapcat:
+    def __init__(self, groups: Dict[int, int], latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 seed: int = 0):
+        self.groups = groups
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    @property
+    def host(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    @property
+    def avatar_url(self) -> str:
+        return f"http://{self.host}/headimg_dl"
+
+    async def _delay(self, action: str):
+        self.requests[action] = self.requests.get(action, 0) + 1
+        delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def _member_list(self, request: web.Request) -> web.Response:
+        await self._delay("get_group_member_list")
+        body = await request.json()
+        group_id = int(body["group_id"])
+        if group_id not in self.groups:
+            return web.json_response({"status": "failed", "retcode": 1200, "data": None})
+        data = [{"user_id": uid, "nickname": f"成员{uid}", "card": f"群名片{uid}" if uid % 3 == 0 else ""}
+                for uid in member_ids(group_id, self.groups[group_id])]
+        return web.json_response({"status": "ok", "retcode": 0, "data": data})
+
+    async def _member_info(self, request: web.Request) -> web.Response:
+        await self._delay("get_group_member_info")
+        body = await request.json()
+        user_id = int(body["user_id"])
+        return web.json_response({"status": "ok", "retcode": 0,
+                                  "data": {"user_id": user_id, "nickname": f"成员{user_id}", "card": ""}})
+
+    async def _status(self, request: web.Request) -> web.Response:
+        await self._delay("get_status")
+        return web.json_response({"status": "ok", "retcode": 0, "data": {"online": True, "good": True}})
+
+    async def _avatar(self, request: web.Request) -> web.Response:
+        await self._delay("headimg_dl")
+        return web.Response(body=AVATAR_BYTES, content_type="image/png")
+
+    async def start(self, port: int = 0):
+        app = web.Application()
+        app.router.add_post("/get_group_member_list", self._member_list)
+        app.router.add_post("/get_group_member_info", self._member_info)
+        app.router.add_post("/get_status", self._status)
+        app.router.add_get("/headimg_dl", self._avatar)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,90 @@
+"""
+后台写入失败重试检查：让冷静期数据文件暂时不可写，执行一次“我要分手”，
+确认写入失败被计入 persist_errors_total、存储被放回脏集合，并在文件恢复可写后自动重试落盘。
+任一检查失败时以非零状态退出。
+
+需要在装有 AstrBot 的环境中运行，不访问外网：
+    python benchmarks/persist_retry_check.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_draws import FakeEvent, load_plugin_module
+from fake_napcat import FakeNapcat, member_ids
+
+GROUP_ID = 114514
+
+
+async def run() -> int:
+    workdir = Path(tempfile.mkdtemp(prefix="dailywife_retry_"))
+    napcat = FakeNapcat({GROUP_ID: 20})
+    await napcat.start()
+    quiet = io.StringIO()
+    errors = []
+    try:
+        module = load_plugin_module(workdir)
+        config = {
+            "napcat_host": napcat.host,
+            "show_avatar": False,
+            "persist_interval": 0.05,
+            "max_daily_breakups": 3,
+            "breakup_block_hours": 24,
+        }
+        with contextlib.redirect_stdout(quiet):
+            plugin = module.DailyWifePlugin(SimpleNamespace(send_message=None), config)
+        writer = plugin._persister
+        # 用同名目录占住数据文件，使替换写入失败
+        cooling_path = module.COOLING_DATA_PATH
+        cooling_path.unlink(missing_ok=True)
+        cooling_path.mkdir()
+
+        user_id = member_ids(GROUP_ID, 20)[0]
+        with contextlib.redirect_stdout(quiet):
+            async for _ in plugin.daily_wife_command(FakeEvent(GROUP_ID, user_id, "今日老婆")):
+                pass
+            async for _ in plugin.divorce_command(FakeEvent(GROUP_ID, user_id, "我要分手")):
+                pass
+            await asyncio.sleep(0.5)
+
+        persist_errors = plugin._metrics.counters("persist_errors_total").get((("store", "cooling"),), 0)
+        if persist_errors < 1:
+            errors.append("冷静期写入失败没有计入 persist_errors_total")
+        if "cooling" not in writer._dirty or writer._retry is None:
+            errors.append("冷静期写入失败后没有放回脏集合并安排重试")
+
+        cooling_path.rmdir()
+        with contextlib.redirect_stdout(quiet):
+            # 首次重试的退避为 1 秒
+            await asyncio.sleep(2)
+        if not cooling_path.is_file():
+            errors.append("文件恢复可写后冷静期数据没有重试落盘")
+        else:
+            with open(cooling_path, "r", encoding="utf-8") as f:
+                if not json.load(f):
+                    errors.append("重试落盘的冷静期数据为空")
+        if writer._dirty:
+            errors.append(f"重试后仍有未落盘的存储: {sorted(writer._dirty)}")
+
+        with contextlib.redirect_stdout(quiet):
+            await plugin.terminate()
+    finally:
+        await napcat.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        return 1
+    print("✅ JSON 存储写入失败已计入指标，并在恢复后自动重试落盘")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
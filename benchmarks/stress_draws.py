@@ -0,0 +1,149 @@
+"""
+并发抽取压力检查：在本地 Napcat 替身上同时发起数百次“今日老婆”，并混入指向同一批热门目标的
+“许愿”“强娶”，检查配对是否对称（a 的伴侣是 b 当且仅当 b 的伴侣是 a）、没有人同时处于两段配对中，
+并确认落盘后重新加载得到的配对与内存一致。任一检查失败时以非零状态退出。
+
+需要在装有 AstrBot 的环境中运行，不访问外网：
+    python benchmarks/stress_draws.py --groups 4 --size 60 --rounds 3 --hot 5 --backend json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_draws import FakeEvent, load_plugin_module
+from fake_napcat import FakeNapcat, member_ids
+
+
+def check_group(group_id: int, group_data) -> list:
+    """返回该群配对中违反约束的描述，空列表表示通过"""
+    errors = []
+    partners = {}
+    for uid, record in group_data.pairs.items():
+        if record.partner == uid:
+            errors.append(f"群 {group_id}: {uid} 与自己配对")
+        other = group_data.pairs.get(record.partner)
+        if other is None or other.partner != uid:
+            errors.append(f"群 {group_id}: {uid} -> {record.partner} 不对称")
+        partners.setdefault(record.partner, []).append(uid)
+    for target, owners in partners.items():
+        if len(owners) > 1:
+            errors.append(f"群 {group_id}: {target} 同时是 {owners} 的伴侣")
+    return errors
+
+
+async def snapshot(plugin, group_ids) -> dict:
+    result = {}
+    for gid in group_ids:
+        await plugin._check_reset(gid)
+        result[gid] = {uid: record.partner for uid, record in plugin.pair_data[gid].pairs.items()}
+    return result
+
+
+async def run(args) -> int:
+    workdir = Path(tempfile.mkdtemp(prefix="dailywife_stress_"))
+    groups = {100_001 + i: args.size for i in range(args.groups)}
+    napcat = FakeNapcat(groups, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    await napcat.start()
+    quiet = io.StringIO()
+    try:
+        module = load_plugin_module(workdir)
+        config = {
+            "napcat_host": napcat.host,
+            "avatar_api_url": napcat.avatar_url,
+            "show_avatar": False,
+            "storage_backend": args.backend,
+            "persist_interval": 0.05,
+            "max_daily_breakups": 3,
+            "breakup_block_hours": 24,
+            "enable_advanced_globally": True,
+            "max_daily_wishes": args.rounds,
+            "max_daily_rob_attempts": args.rounds,
+        }
+        with contextlib.redirect_stdout(quiet):
+            plugin = module.DailyWifePlugin(SimpleNamespace(send_message=None), config)
+
+        # 每个成员在每一轮都发一次命令，所有请求一次性并发打出，同一成员的多次请求会相互竞争
+        events = [
+            FakeEvent(gid, uid, "今日老婆")
+            for gid, size in groups.items()
+            for uid in member_ids(gid, size)
+            for _ in range(args.rounds)
+        ]
+        # 每个成员每一轮还会对本群少数热门目标各发一次许愿和强娶，与抽取争抢同一批成员
+        rng = random.Random(args.seed)
+        for gid, size in groups.items():
+            ids = member_ids(gid, size)
+            hot = ids[:args.hot]
+            for uid in ids:
+                for _ in range(args.rounds):
+                    for command in ("许愿", "强娶"):
+                        target = rng.choice([t for t in hot if t != uid])
+                        events.append(FakeEvent(gid, uid, f"{command} {target}"))
+        rng.shuffle(events)
+
+        async def send(event):
+            command, _, target = event.message_str.partition(" ")
+            if command == "许愿":
+                handler = plugin.wish_command(event, int(target))
+            elif command == "强娶":
+                handler = plugin.rob_command(event, int(target))
+            else:
+                handler = plugin.daily_wife_command(event)
+            async for _ in handler:
+                pass
+
+        with contextlib.redirect_stdout(quiet):
+            await asyncio.gather(*(send(event) for event in events))
+
+        group_ids = [str(gid) for gid in groups]
+        errors = []
+        for gid in group_ids:
+            errors.extend(check_group(gid, plugin.pair_data[gid]))
+        before = await snapshot(plugin, group_ids)
+
+        with contextlib.redirect_stdout(quiet):
+            await plugin.terminate()
+            plugin = module.DailyWifePlugin(SimpleNamespace(send_message=None), config)
+        after = await snapshot(plugin, group_ids)
+        for gid in group_ids:
+            errors.extend(check_group(gid, plugin.pair_data[gid]))
+            if after[gid] != before[gid]:
+                errors.append(f"群 {gid}: 重新加载后的配对与内存不一致")
+        with contextlib.redirect_stdout(quiet):
+            await plugin.terminate()
+
+        pairs = sum(len(p) for p in before.values()) // 2
+        print(f"后端 {args.backend}：{len(events)} 次并发命令（抽取/许愿/强娶），{len(groups)} 个群，{pairs} 对配对")
+        if errors:
+            for error in errors[:20]:
+                print(f"❌ {error}")
+            print(f"❌ 共 {len(errors)} 处违反约束")
+            return 1
+        print("✅ 所有配对对称，且没有成员同时处于两段配对中")
+        return 0
+    finally:
+        await napcat.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DailyWife 并发抽取压力检查")
+    parser.add_argument("--groups", type=int, default=4, help="同时抽取的群数")
+    parser.add_argument("--size", type=int, default=60, help="每个群的成员数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个成员重复发送命令的次数")
+    parser.add_argument("--hot", type=int, default=5, help="每个群许愿/强娶集中指向的热门目标数")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Napcat 替身的固定响应延迟")
+    parser.add_argument("--jitter-ms", type=float, default=3.0, help="在固定延迟上叠加的随机抖动上限")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.hot < 2:
+        parser.error("--hot 至少为 2")
+    sys.exit(asyncio.run(run(args)))
@@ -2,16 +2,27 @@ from astrbot.api.all import *
 import astrbot.api.event.filter as filter
 from astrbot.api.message_components import *
 from datetime import datetime, timedelta
+import bisect
+import functools
 import random
+import sys
 import json
 import aiohttp
 import asyncio
 import traceback
 import time
+import heapq
+import mmap
+import struct
+import sqlite3
+from array import array
 import astrbot.api.message_components as Comp
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
 from urllib.parse import urlparse
-from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
 from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
     AiocqhttpMessageEvent,
 )
@@ -19,10 +30,24 @@ from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
 # --------------- 路径配置 ---------------
 PLUGIN_DIR = Path(__file__).parent
 PAIR_DATA_PATH = PLUGIN_DIR / "pair_data.json"
+PAIR_JOURNAL_PATH = PLUGIN_DIR / "pair_data.journal"
 COOLING_DATA_PATH = PLUGIN_DIR / "cooling_data.json"
 BLOCKED_USERS_PATH = PLUGIN_DIR / "blocked_users.json"
 BREAKUP_COUNT_PATH = PLUGIN_DIR / "breakup_counts.json"
 ADVANCED_ENABLED_PATH = PLUGIN_DIR / "advanced_enabled.json"
+ADVANCED_USAGE_PATH = PLUGIN_DIR / "advanced_usage.json"
+SQLITE_DB_PATH = PLUGIN_DIR / "daily_wife.db"
+AVATAR_CACHE_DIR = PLUGIN_DIR / "avatar_cache"
+MEMBER_SNAPSHOT_DIR = PLUGIN_DIR / "member_snapshots"
+GROUP_DATA_DIR = PLUGIN_DIR / "groups"
+# 用于修补成员索引的群通知类型（OneBot v11）
+MEMBER_NOTICE_TYPES = {"group_increase", "group_decrease", "group_card"}
+# 成员索引全量校准时，相邻两个群之间的间隔（秒）
+MEMBER_RESYNC_SPACING = 1.0
+# 全群配对结果每页显示的配对数
+BULK_PAIR_PAGE_SIZE = 20
+# 磁盘头像缓存清理过期文件的间隔（秒）
+AVATAR_SWEEP_INTERVAL = 3600
 
 # --------------- 数据结构 ---------------
 class GroupMember:
@@ -37,67 +62,1450 @@ class GroupMember:
         """带QQ号的显示信息"""
         return f"{self.card or self.nickname}({self.user_id})"
 
+class PairRecord:
+    """单条配对记录：对象 QQ 号(int) + 对象昵称（每对配对在双方各存一条）"""
+    __slots__ = ("partner", "name", "is_initiator", "locked")
+
+    def __init__(self, partner: int, name: str, is_initiator: Optional[bool] = None, locked: bool = False):
+        self.partner = partner
+        # 昵称驻留，同一昵称在所有群的记录中共享同一个字符串对象
+        self.name = sys.intern(name)
+        self.is_initiator = is_initiator
+        self.locked = locked
+
+    @classmethod
+    def from_json(cls, entry: dict) -> "PairRecord":
+        partner = int(entry["user_id"])
+        name = entry.get("display_name") or "未知用户"
+        suffix = f"({partner})"
+        if name.endswith(suffix):
+            name = name[:-len(suffix)].strip()
+        return cls(partner, name, entry.get("is_initiator"), bool(entry.get("locked", False)))
+
+    def to_json(self) -> dict:
+        entry = {"user_id": str(self.partner), "display_name": f"{self.name}({self.partner})"}
+        if self.is_initiator is not None:
+            entry["is_initiator"] = self.is_initiator
+        if self.locked:
+            entry["locked"] = True
+        return entry
+
+class GroupPairs:
+    """单个群当日的配对状态，用户 ID 以 int 保存；方法参数接受 str 或 int"""
+    __slots__ = ("date", "pairs", "used")
+
+    def __init__(self, date: Optional[str], pairs: Optional[Dict[int, PairRecord]] = None,
+                 used: Optional[Set[int]] = None):
+        self.date = date
+        self.pairs: Dict[int, PairRecord] = pairs if pairs is not None else {}
+        self.used: Set[int] = used if used is not None else set()
+
+    def partner(self, user_id) -> Optional[PairRecord]:
+        return self.pairs.get(int(user_id))
+
+    def is_paired(self, user_id) -> bool:
+        return int(user_id) in self.pairs
+
+    def is_used(self, user_id) -> bool:
+        return int(user_id) in self.used
+
+    def mark_used(self, user_id):
+        self.used.add(int(user_id))
+
+    def pair(self, user_id, user_name: str, target_id, target_name: str):
+        """双向写入配对，并把双方记为今日已参与"""
+        uid, tid = int(user_id), int(target_id)
+        self.pairs[uid] = PairRecord(tid, target_name)
+        self.pairs[tid] = PairRecord(uid, user_name)
+        self.mark_used(uid)
+        self.mark_used(tid)
+
+    def unpair(self, user_id) -> Optional[int]:
+        """删除用户的配对（对方记录仍指向该用户时一并删除），返回原对象 QQ 号"""
+        uid = int(user_id)
+        record = self.pairs.pop(uid, None)
+        if record is None:
+            return None
+        other = self.pairs.get(record.partner)
+        if other is not None and other.partner == uid:
+            del self.pairs[record.partner]
+        return record.partner
+
+    def release(self, *user_ids):
+        """把用户移出今日已参与名单"""
+        self.used.difference_update(int(uid) for uid in user_ids)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "GroupPairs":
+        return cls(
+            data.get("date"),
+            {int(uid): PairRecord.from_json(entry) for uid, entry in data.get("pairs", {}).items()},
+            {int(uid) for uid in data.get("used", [])},
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "date": self.date,
+            "pairs": {str(uid): record.to_json() for uid, record in self.pairs.items()},
+            "used": [str(uid) for uid in sorted(self.used)],
+        }
+
+class PairStore(dict):
+    """配对数据：群号 -> GroupPairs；to_json/from_json 与 pair_data.json 的结构一致"""
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "PairStore":
+        store = cls()
+        for group_id, group in data.items():
+            try:
+                store[group_id] = GroupPairs.from_json(group)
+            except (KeyError, TypeError, ValueError):
+                print(f"⚠️ 跳过无法解析的群配对数据: {group_id}")
+        return store
+
+    def to_json(self) -> Dict:
+        return {group_id: group.to_json() for group_id, group in self.items()}
+
+class AdvancedUsage:
+    """进阶功能当日使用次数：每个 (群, 用户) 一个定长计数数组 [许愿, 强娶, 锁定]，跨天整体清空"""
+    KINDS = ("wish", "rob", "lock")
+    _MAX = 0xFFFF
+
+    def __init__(self, date: str = ""):
+        self.date = date
+        self._counts: Dict[str, Dict[str, array]] = {}
+
+    def get(self, group_id: str, user_id: str, kind: str) -> int:
+        counts = self._counts.get(group_id, {}).get(user_id)
+        return counts[self.KINDS.index(kind)] if counts is not None else 0
+
+    def incr(self, group_id: str, user_id: str, kind: str):
+        group = self._counts.setdefault(group_id, {})
+        counts = group.get(user_id)
+        if counts is None:
+            counts = group[user_id] = array("H", bytes(2 * len(self.KINDS)))
+        index = self.KINDS.index(kind)
+        counts[index] = min(counts[index] + 1, self._MAX)
+
+    def reset(self, date: str):
+        self.date = date
+        self._counts = {}
+
+    def group_json(self, group_id: str) -> Dict[str, list]:
+        return {uid: list(counts) for uid, counts in self._counts.get(group_id, {}).items()}
+
+    def load_group(self, group_id: str, users: Dict[str, list]):
+        """载入单个群的计数（按群分片存储时使用）"""
+        if users:
+            self._counts[group_id] = {uid: array("H", counts) for uid, counts in users.items()}
+
+    def drop_group(self, group_id: str):
+        self._counts.pop(group_id, None)
+
+    def rows(self) -> Dict[tuple, tuple]:
+        return { (self.date, gid, uid): tuple(counts)
+                 for gid, users in self._counts.items() for uid, counts in users.items() }
+
+    @classmethod
+    def from_rows(cls, date: str, rows: Dict[tuple, tuple]) -> "AdvancedUsage":
+        usage = cls(date)
+        for (row_date, gid, uid), counts in rows.items():
+            if row_date == date:
+                usage._counts.setdefault(gid, {})[uid] = array("H", counts)
+        return usage
+
+    def to_json(self) -> dict:
+        return {"date": self.date,
+                "counts": {gid: {uid: list(counts) for uid, counts in users.items()}
+                           for gid, users in self._counts.items()}}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "AdvancedUsage":
+        usage = cls(data.get("date", ""))
+        for gid, users in data.get("counts", {}).items():
+            usage._counts[gid] = {uid: array("H", counts) for uid, counts in users.items()}
+        return usage
+
+class BreakupCounter:
+    """分手次数滚动窗口：按天分桶，同时维护每个 (群, 用户) 在窗口内的总数，过期的天整桶淘汰"""
+    def __init__(self, window_days: int = 1):
+        self.window_days = max(1, int(window_days))
+        self._days: "OrderedDict[str, Dict[Tuple[str, str], int]]" = OrderedDict()
+        self._totals: Dict[Tuple[str, str], int] = {}
+
+    def count(self, group_id: str, user_id: str) -> int:
+        return self._totals.get((group_id, user_id), 0)
+
+    def incr(self, date: str, group_id: str, user_id: str):
+        key = (group_id, user_id)
+        bucket = self._days.get(date)
+        if bucket is None:
+            bucket = self._days[date] = {}
+            self._days.move_to_end(date)
+        bucket[key] = bucket.get(key, 0) + 1
+        self._totals[key] = self._totals.get(key, 0) + 1
+
+    def evict(self, today: str) -> bool:
+        """淘汰窗口以外的天，返回是否有数据被删除"""
+        cutoff = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=self.window_days - 1)).strftime("%Y-%m-%d")
+        evicted = False
+        while self._days:
+            date = next(iter(self._days))
+            if date >= cutoff:
+                break
+            for key, count in self._days.pop(date).items():
+                remaining = self._totals[key] - count
+                if remaining > 0:
+                    self._totals[key] = remaining
+                else:
+                    del self._totals[key]
+            evicted = True
+        return evicted
+
+    def rows(self) -> Dict[tuple, tuple]:
+        return { (date, gid, uid): (count,) for date, bucket in self._days.items() for (gid, uid), count in bucket.items() }
+
+    @classmethod
+    def from_rows(cls, window_days: int, rows: Dict[tuple, tuple]) -> "BreakupCounter":
+        counter = cls(window_days)
+        # 按日期顺序建桶，保证淘汰时从最早的一天开始
+        for (date, gid, uid), (count,) in sorted(rows.items()):
+            bucket = counter._days.setdefault(date, {})
+            bucket[(gid, uid)] = int(count)
+            counter._totals[(gid, uid)] = counter._totals.get((gid, uid), 0) + int(count)
+        return counter
+
+    def to_json(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        data: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for date, bucket in self._days.items():
+            for (gid, uid), count in bucket.items():
+                data.setdefault(date, {}).setdefault(gid, {})[uid] = count
+        return data
+
+class CoolingIndex:
+    """冷静期索引：按无序用户对查询，维护每个用户的冷静期对象集合，过期记录由最小堆按时间淘汰"""
+    def __init__(self, clock: Callable[[], datetime] = datetime.now):
+        self._clock = clock
+        self._expire: Dict[Tuple[str, str], datetime] = {}
+        self._partners: Dict[str, Set[str]] = {}
+        self._heap: List[Tuple[datetime, Tuple[str, str]]] = []
+
+    @staticmethod
+    def _key(user1: str, user2: str) -> Tuple[str, str]:
+        return (user1, user2) if user1 <= user2 else (user2, user1)
+
+    def add(self, user1: str, user2: str, expire_time: datetime):
+        key = self._key(user1, user2)
+        if key in self._expire and self._expire[key] >= expire_time:
+            return
+        self._expire[key] = expire_time
+        heapq.heappush(self._heap, (expire_time, key))
+        self._partners.setdefault(user1, set()).add(user2)
+        self._partners.setdefault(user2, set()).add(user1)
+
+    def _purge(self):
+        now = self._clock()
+        while self._heap and self._heap[0][0] <= now:
+            expire_time, key = heapq.heappop(self._heap)
+            # 同一对用户被延长过冷静期时，堆中会留下较早的过期记录
+            if self._expire.get(key) != expire_time:
+                continue
+            del self._expire[key]
+            for a, b in (key, key[::-1]):
+                partners = self._partners.get(a)
+                if partners is not None:
+                    partners.discard(b)
+                    if not partners:
+                        del self._partners[a]
+
+    def contains(self, user1: str, user2: str) -> bool:
+        self._purge()
+        return self._key(user1, user2) in self._expire
+
+    def partners(self, user_id: str) -> Set[str]:
+        """与该用户仍处于冷静期的所有用户"""
+        self._purge()
+        return self._partners.get(user_id, set())
+
+class DrawPool:
+    """可抽取成员池：数组 + 下标字典，随机取样和交换删除均为 O(1)"""
+    def __init__(self, user_ids: Iterable[str]):
+        self._items: List[str] = list(user_ids)
+        self._index: Dict[str, int] = {uid: i for i, uid in enumerate(self._items)}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._index
+
+    def add(self, user_id: str):
+        if user_id not in self._index:
+            self._index[user_id] = len(self._items)
+            self._items.append(user_id)
+
+    def discard(self, user_id: str):
+        i = self._index.pop(user_id, None)
+        if i is None:
+            return
+        last = self._items.pop()
+        if i < len(self._items):
+            self._items[i] = last
+            self._index[last] = i
+
+    def sample(self, rng: random.Random) -> str:
+        return self._items[rng.randrange(len(self._items))]
+
+    def items(self) -> List[str]:
+        return list(self._items)
+
+class WifeMatcher:
+    """今日老婆抽取引擎：按群、按日维护未配对成员池，通过拒绝采样排除不可选的成员"""
+    def __init__(self, rng: Optional[random.Random] = None, max_rejections: int = 32):
+        self.rng = rng or random.Random()
+        self.max_rejections = max_rejections
+        # group_id -> (日期, 成员列表, {user_id: GroupMember}, 成员池)
+        self._pools: Dict[str, Tuple[str, List[GroupMember], Dict[str, GroupMember], DrawPool]] = {}
+
+    def pool(self, group_id: str, date: str, members: List[GroupMember],
+             unavailable: Callable[[str], bool]) -> Tuple[Dict[str, GroupMember], DrawPool]:
+        """获取群当日的成员池；日期变化或成员列表被刷新时重建"""
+        entry = self._pools.get(group_id)
+        if entry is not None and entry[0] == date and entry[1] is members:
+            return entry[2], entry[3]
+        by_id = {m.user_id: m for m in members}
+        pool = DrawPool(uid for uid in by_id if not unavailable(uid))
+        self._pools[group_id] = (date, members, by_id, pool)
+        return by_id, pool
+
+    def draw(self, pool: DrawPool, unavailable: Callable[[str], bool],
+             excluded: Callable[[str], bool]) -> Optional[str]:
+        """随机抽取一名成员。unavailable 为当日已不可抽取的成员（会被移出成员池），
+        excluded 为仅对本次抽取者不可选的成员（冷静期、屏蔽等）"""
+        for _ in range(self.max_rejections):
+            if not pool:
+                return None
+            uid = pool.sample(self.rng)
+            if unavailable(uid):
+                pool.discard(uid)
+            elif not excluded(uid):
+                return uid
+        # 多次拒绝说明剩余成员大多不可选，退化为一次线性筛选
+        candidates = []
+        for uid in pool.items():
+            if unavailable(uid):
+                pool.discard(uid)
+            elif not excluded(uid):
+                candidates.append(uid)
+        return self.rng.choice(candidates) if candidates else None
+
+    def match_all(self, user_ids: Iterable[str], conflict: Callable[[str, str], bool]) -> List[Tuple[str, str]]:
+        """一次性为所有候选成员计算随机极大匹配：打乱顺序后逐个与等待列表中不冲突的成员配对。
+        等待列表中的成员两两冲突，因此结果无法再添加任何一对；冲突稀少时整体接近 O(n)"""
+        order = list(user_ids)
+        self.rng.shuffle(order)
+        waiting: List[str] = []
+        pairs: List[Tuple[str, str]] = []
+        for uid in order:
+            for i in range(len(waiting) - 1, -1, -1):
+                if not conflict(uid, waiting[i]):
+                    other = waiting[i]
+                    waiting[i] = waiting[-1]
+                    waiting.pop()
+                    pairs.append((other, uid))
+                    break
+            else:
+                waiting.append(uid)
+        return pairs
+
+    def mark_paired(self, group_id: str, user_ids: Iterable[str]):
+        entry = self._pools.get(group_id)
+        if entry is not None:
+            for uid in user_ids:
+                entry[3].discard(uid)
+
+    def release(self, group_id: str, user_ids: Iterable[str]):
+        """成员重新变为可抽取（如分手）时放回成员池"""
+        entry = self._pools.get(group_id)
+        if entry is not None:
+            for uid in user_ids:
+                if uid in entry[2]:
+                    entry[3].add(uid)
+
+    def add_member(self, group_id: str, member: GroupMember):
+        """新成员入群时加入成员池；当日不可抽取的成员会在抽取时被拒绝采样移除"""
+        entry = self._pools.get(group_id)
+        if entry is not None:
+            entry[2][member.user_id] = member
+            entry[3].add(member.user_id)
+
+    def remove_member(self, group_id: str, user_id: str):
+        entry = self._pools.get(group_id)
+        if entry is not None:
+            entry[2].pop(user_id, None)
+            entry[3].discard(user_id)
+
+    def invalidate(self, group_id: Optional[str] = None):
+        if group_id is None:
+            self._pools.clear()
+        else:
+            self._pools.pop(group_id, None)
+
+class GroupLocks:
+    """按群分配的 asyncio 锁：同群的配对提交串行执行，不同群互不阻塞；无人持有时自动回收"""
+    def __init__(self):
+        self._locks: Dict[str, list] = {}  # group_id -> [锁, 持有及等待者数量]
+
+    @asynccontextmanager
+    async def hold(self, group_id: str):
+        entry = self._locks.get(group_id)
+        if entry is None:
+            entry = self._locks[group_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(group_id, None)
+
+    def __contains__(self, group_id: str) -> bool:
+        """该群的锁是否有人持有或等待"""
+        return group_id in self._locks
+
+class SingleFlight:
+    """合并同一键的并发请求：首个调用者发起任务，其余调用者等待同一个结果（包括异常）"""
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def pending(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: str, factory: Callable[[], Awaitable]):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        # 单个调用者被取消时不影响共享的请求
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # 所有等待者都已取消时，避免“异常未被获取”的警告
+            task.exception()
+
+class MemberCache:
+    """群成员列表缓存：按群 LRU 淘汰，记录写入时间供调用方判断新鲜度"""
+    def __init__(self, max_groups: int):
+        self.max_groups = max_groups
+        self._entries: "OrderedDict[str, Tuple[float, List[GroupMember]]]" = OrderedDict()
+        # 群因超出上限被淘汰时的回调，供依附于成员列表的数据一并释放
+        self.on_evict: Optional[Callable[[str], None]] = None
+
+    def get(self, group_id: str) -> Tuple[Optional[List[GroupMember]], float]:
+        """返回 (成员列表, 已缓存秒数)，未命中时返回 (None, 0)"""
+        entry = self._entries.get(group_id)
+        if entry is None:
+            return None, 0
+        self._entries.move_to_end(group_id)
+        stored_at, members = entry
+        return members, time.monotonic() - stored_at
+
+    def put(self, group_id: str, members: List[GroupMember], age: float = 0.0):
+        """写入成员列表；age 为数据已有的秒数（如从快照预热时）。已缓存的群原地替换，不改变 LRU 顺序"""
+        self._entries[group_id] = (time.monotonic() - age, members)
+        while len(self._entries) > self.max_groups:
+            evicted, _ = self._entries.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def invalidate(self, group_id: Optional[str] = None) -> int:
+        """清除指定群（不指定则全部）的缓存，返回清除的群数"""
+        if group_id is None:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+        return 1 if self._entries.pop(group_id, None) is not None else 0
+
+    def __contains__(self, group_id: str) -> bool:
+        return group_id in self._entries
+
+    def _find(self, group_id: str, user_id: str) -> Tuple[Optional[List[GroupMember]], int]:
+        entry = self._entries.get(group_id)
+        if entry is None:
+            return None, -1
+        members = entry[1]
+        for i, member in enumerate(members):
+            if member.user_id == user_id:
+                return members, i
+        return members, -1
+
+    # 以下修补方法按群通知原地修改成员列表，不更新写入时间（写入时间表示上次全量同步）
+    def add_member(self, group_id: str, member: GroupMember) -> bool:
+        members, i = self._find(group_id, member.user_id)
+        if members is None:
+            return False
+        if i >= 0:
+            members[i] = member
+        else:
+            members.append(member)
+        return True
+
+    def remove_member(self, group_id: str, user_id: str) -> bool:
+        members, i = self._find(group_id, user_id)
+        if i < 0:
+            return False
+        members[i] = members[-1]
+        members.pop()
+        return True
+
+    def update_card(self, group_id: str, user_id: str, card: str) -> bool:
+        members, i = self._find(group_id, user_id)
+        if i < 0:
+            return False
+        members[i].card = card
+        return True
+
+    def groups_older_than(self, max_age: float) -> List[str]:
+        """上次全量同步距今超过 max_age 秒的群，不影响 LRU 顺序"""
+        now = time.monotonic()
+        return [gid for gid, (stored_at, _) in self._entries.items() if now - stored_at >= max_age]
+
+class AvatarCache:
+    """头像缓存：内存层按总字节数做 LRU 淘汰，两层都按缓存时间判断过期，磁盘层定期清理过期文件"""
+    def __init__(self, directory: Path, max_memory_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        # 值为 (图片数据, 缓存时间戳)
+        self._memory: "OrderedDict[Tuple[str, int], Tuple[bytes, float]]" = OrderedDict()
+        self._memory_bytes = 0
+
+    def get(self, uin: str, spec: int) -> Optional[bytes]:
+        key = (uin, spec)
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        data, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            del self._memory[key]
+            self._memory_bytes -= len(data)
+            return None
+        self._memory.move_to_end(key)
+        return data
+
+    def remember(self, uin: str, spec: int, data: bytes, stored_at: Optional[float] = None):
+        """stored_at 为缓存时间戳，从磁盘载入时传入文件修改时间，过期时间与磁盘层一致"""
+        key = (uin, spec)
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        self._memory[key] = (data, stored_at if stored_at is not None else time.time())
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def path(self, uin: str, spec: int) -> Path:
+        return self.directory / f"{uin}_{spec}.img"
+
+    def fresh_path(self, uin: str, spec: int) -> Optional[Path]:
+        """磁盘上未过期的缓存文件路径（会访问磁盘，应在线程中调用）"""
+        path = self.path(uin, spec)
+        try:
+            if time.time() - path.stat().st_mtime <= self.ttl:
+                return path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def read_disk(self, uin: str, spec: int) -> Optional[Tuple[bytes, float]]:
+        """未过期的磁盘缓存内容及其修改时间"""
+        path = self.fresh_path(uin, spec)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes(), path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def write_disk(self, uin: str, spec: int, data: bytes) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(uin, spec)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_bytes(data)
+        temp_path.replace(path)
+        return path
+
+    def prune_disk(self) -> int:
+        """删除过期的磁盘缓存文件及残留的临时文件，返回删除数量（会访问磁盘，应在线程中调用）"""
+        if not self.directory.exists():
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for path in self.directory.iterdir():
+            if path.suffix not in (".img", ".tmp"):
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+class MemberSnapshotStore:
+    """群成员列表快照：每群一个列式二进制文件，读取时内存映射，用于冷启动预热和Napcat不可用时兜底。
+    文件布局：文件头 | QQ号列(uint64) | 名称偏移列(uint32，昵称与群名片交替) | UTF-8 名称数据"""
+    MAGIC = b"DWMS"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHdI")  # 魔数、版本、保存时间、成员数
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._saved_at: Dict[str, float] = {}
+
+    def path(self, group_id: str) -> Path:
+        return self.directory / f"{group_id}.bin"
+
+    def scan(self) -> int:
+        """启动时只读取各快照的文件头，记录保存时间，成员数据在首次使用时才解码"""
+        self._saved_at.clear()
+        if not self.directory.exists():
+            return 0
+        for path in self.directory.glob("*.bin"):
+            try:
+                with open(path, "rb") as f:
+                    magic, version, saved_at, _ = self.HEADER.unpack(f.read(self.HEADER.size))
+            except (OSError, struct.error):
+                continue
+            if magic == self.MAGIC and version == self.VERSION:
+                self._saved_at[path.stem] = saved_at
+        return len(self._saved_at)
+
+    def age(self, group_id: str) -> Optional[float]:
+        """快照距今的秒数，没有快照时返回 None"""
+        saved_at = self._saved_at.get(group_id)
+        return None if saved_at is None else max(0.0, time.time() - saved_at)
+
+    def forget(self, group_id: Optional[str] = None):
+        """不再使用指定群（不指定则全部）的现有快照，下次成功拉取成员后重新保存"""
+        if group_id is None:
+            self._saved_at.clear()
+        else:
+            self._saved_at.pop(group_id, None)
+
+    def save(self, group_id: str, members: List[GroupMember]):
+        """写入快照（会访问磁盘，应在线程中调用）"""
+        user_ids = array("Q", (int(m.user_id) for m in members))
+        offsets = array("I", [0])
+        names = bytearray()
+        for member in members:
+            for text in (member.nickname, member.card):
+                names += (text or "").encode("utf-8")
+                offsets.append(len(names))
+        saved_at = time.time()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(group_id)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, saved_at, len(user_ids)))
+            f.write(user_ids.tobytes())
+            f.write(offsets.tobytes())
+            f.write(names)
+        temp_path.replace(path)
+        self._saved_at[group_id] = saved_at
+
+    def load(self, group_id: str) -> Optional[List[GroupMember]]:
+        """内存映射快照文件并解码成员列表（会访问磁盘，应在线程中调用）"""
+        try:
+            with open(self.path(group_id), "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, _, count = self.HEADER.unpack_from(mm, 0)
+                if magic != self.MAGIC or version != self.VERSION:
+                    return None
+                user_ids, offsets = array("Q"), array("I")
+                pos = self.HEADER.size
+                end = pos + count * user_ids.itemsize
+                names_start = end + (count * 2 + 1) * offsets.itemsize
+                if len(mm) < names_start:
+                    return None
+                user_ids.frombytes(mm[pos:end])
+                offsets.frombytes(mm[end:names_start])
+                # 文件长度必须与头部记录的成员数及名称数据长度一致，截断或损坏的快照直接放弃
+                if len(mm) != names_start + offsets[-1]:
+                    return None
+                names = mm[names_start:]
+                return [
+                    GroupMember({
+                        "user_id": uid,
+                        "nickname": names[offsets[2 * i]:offsets[2 * i + 1]].decode("utf-8"),
+                        "card": names[offsets[2 * i + 1]:offsets[2 * i + 2]].decode("utf-8"),
+                    })
+                    for i, uid in enumerate(user_ids)
+                ]
+        except (OSError, ValueError, IndexError, struct.error):
+            # UnicodeDecodeError 是 ValueError 的子类
+            return None
+
+class HostHealth:
+    """单个Napcat主机的健康统计"""
+    __slots__ = ("successes", "failures", "consecutive_failures", "latency", "state",
+                 "open_until", "backoff", "probing", "warmed")
+
+    def __init__(self, base_backoff: float):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency: Optional[float] = None  # 指数加权平均延迟（秒）
+        self.state = "closed"  # closed 正常 / open 熔断 / half_open 探测中
+        self.open_until = 0.0
+        self.backoff = base_backoff
+        self.probing = False
+        self.warmed = False  # 是否已为尚无延迟数据的主机安排过预热探测
+
+class NapcatHostManager:
+    """Napcat主机选择：健康主机按延迟排序，连续失败的主机熔断，退避结束后通过探测恢复"""
+    LATENCY_ALPHA = 0.3
+    LATENCY_SAMPLES = 200
+
+    def __init__(self, hosts: List[str], failure_threshold: int = 3,
+                 base_backoff: float = 5, max_backoff: float = 300):
+        self.hosts = list(hosts)
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._health: Dict[str, HostHealth] = {host: HostHealth(base_backoff) for host in self.hosts}
+        # 近期成功请求的延迟样本（按接口区分、不区分主机），用于计算对冲延迟
+        self._samples: Dict[str, "deque[float]"] = {}
+
+    def candidates(self) -> List[str]:
+        """健康主机按平均延迟升序；全部熔断时仍按恢复时间先后尝试，避免完全不可用"""
+        healthy = [h for h in self.hosts if self._health[h].state == "closed"]
+        if healthy:
+            # 尚无延迟数据的主机按配置顺序排在已测得延迟的主机之后，其延迟由后台预热探测获得
+            return sorted(healthy, key=lambda h: (self._health[h].latency is None, self._health[h].latency or 0.0))
+        return sorted(self.hosts, key=lambda h: self._health[h].open_until)
+
+    def due_probes(self) -> List[str]:
+        """熔断期已过需要半开探测、或尚无延迟数据需要预热的主机（调用后标记为探测中）"""
+        now = time.monotonic()
+        due = []
+        for host, health in self._health.items():
+            if health.probing:
+                continue
+            if health.state == "open" and now >= health.open_until:
+                health.state = "half_open"
+                health.probing = True
+                due.append(host)
+            elif health.state == "closed" and health.latency is None and not health.warmed:
+                health.warmed = True
+                health.probing = True
+                due.append(host)
+        return due
+
+    def probe_finished(self, host: str):
+        health = self._health.get(host)
+        if health is not None:
+            health.probing = False
+            # 探测既未成功也未计为失败（如响应无法解析）时重新进入熔断，等待下一轮探测
+            if health.state == "half_open":
+                health.state = "open"
+                health.open_until = time.monotonic() + health.backoff
+
+    def record_success(self, host: str, latency: float, action: str):
+        health = self._health.get(host)
+        if health is None:
+            return
+        health.successes += 1
+        health.consecutive_failures = 0
+        samples = self._samples.get(action)
+        if samples is None:
+            samples = self._samples[action] = deque(maxlen=self.LATENCY_SAMPLES)
+        samples.append(latency)
+        if health.latency is None:
+            health.latency = latency
+        else:
+            health.latency += self.LATENCY_ALPHA * (latency - health.latency)
+        health.state = "closed"
+        health.backoff = self.base_backoff
+
+    def record_lower_bound(self, host: str, elapsed: float):
+        """对冲中落败被取消的请求：真实延迟至少为已等待的时间，据此抬高该主机的延迟估计（不计入延迟样本）"""
+        health = self._health.get(host)
+        if health is None:
+            return
+        if health.latency is None or elapsed > health.latency:
+            health.latency = elapsed
+
+    def record_failure(self, host: str):
+        health = self._health.get(host)
+        if health is None:
+            return
+        health.failures += 1
+        health.consecutive_failures += 1
+        if health.state == "half_open" or health.consecutive_failures >= self.failure_threshold:
+            if health.state != "open":
+                health.open_until = time.monotonic() + health.backoff
+                health.backoff = min(health.backoff * 2, self.max_backoff)
+            health.state = "open"
+
+    def latency_percentile(self, q: float, action: str, min_samples: int = 20) -> Optional[float]:
+        samples = self._samples.get(action)
+        if samples is None or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        return [{
+            "host": host,
+            "state": health.state,
+            "successes": health.successes,
+            "failures": health.failures,
+            "consecutive_failures": health.consecutive_failures,
+            "latency_ms": health.latency * 1000 if health.latency is not None else None,
+            "retry_in": max(0.0, health.open_until - now),
+        } for host, health in self._health.items()]
+
+# --------------- 运行指标 ---------------
+class Metrics:
+    """轻量运行指标：计数器与固定分桶的耗时直方图，可导出为 Prometheus 文本格式"""
+    # 直方图分桶上界（秒）
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, prefix: str = "dailywife"):
+        self.prefix = prefix
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        # (名称, 标签) -> [各分桶计数(最后一个为 +Inf), 总耗时, 总次数]
+        self._histograms: Dict[Tuple[str, tuple], list] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+        return name, tuple(sorted(labels.items()))
+
+    def incr(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+        hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counters(self, name: str) -> Dict[tuple, float]:
+        return { labels: value for (n, labels), value in self._counters.items() if n == name }
+
+    def histograms(self, name: str) -> Dict[tuple, Tuple[int, float, Optional[float], Optional[float]]]:
+        """返回 {标签: (次数, 平均耗时, p50, p99)}，分位数取所在分桶的上界"""
+        result = {}
+        for (n, labels), (buckets, total, count) in self._histograms.items():
+            if n == name and count:
+                result[labels] = (count, total / count, self._quantile(buckets, count, 0.5),
+                                  self._quantile(buckets, count, 0.99))
+        return result
+
+    def _quantile(self, buckets: List[int], count: int, q: float) -> Optional[float]:
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.BUCKETS, buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        """计数器按精确值输出，避免大数被截成科学计数法导致 rate() 失真"""
+        if float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name in sorted({n for n, _ in self._counters}):
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for labels, value in sorted(self.counters(name).items()):
+                lines.append(f"{self.prefix}_{name}{self._labels(labels)} {self._format_value(value)}")
+        for name in sorted({n for n, _ in self._histograms}):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for (n, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, n_bucket in zip(self.BUCKETS + (float("inf"),), buckets):
+                    cumulative += n_bucket
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    bucket_labels = self._labels(labels, 'le="' + le + '"')
+                    lines.append(f"{metric}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{metric}_sum{self._labels(labels)} {total:.6f}")
+                lines.append(f"{metric}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def instrumented(command: str):
+    """记录命令的调用次数与总耗时（含回复发送）；需放在 filter 装饰器之下，紧贴函数定义"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, event, *args, **kwargs):
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                async for result in func(self, event, *args, **kwargs):
+                    yield result
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                self._metrics.observe("command_seconds", time.perf_counter() - start, command=command)
+                self._metrics.incr("commands_total", command=command, status=status)
+        return wrapper
+    return decorator
+
+# --------------- 持久化 ---------------
+class CoalescingWriter:
+    """后台合并写入器：数据变更只打脏标记，每个存储在一个间隔内最多落盘一次"""
+    # 写入失败后重试的最长退避时间（秒）
+    RETRY_MAX_BACKOFF = 300
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stores: Dict[str, Callable[[], Optional[Callable[[], None]]]] = {}
+        self._dirty: Set[str] = set()
+        # 各存储连续写入失败的次数，用于计算重试退避
+        self._failures: Dict[str, int] = {}
+        self._retry: Optional[asyncio.TimerHandle] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 每次写入完成后回调 (存储名, 耗时秒数, 是否成功)
+        self.on_write: Optional[Callable[[str, float, bool], None]] = None
+
+    def register(self, name: str, prepare: Callable[[], Optional[Callable[[], None]]]):
+        """prepare 在事件循环中执行，拷贝或序列化数据后返回在线程中执行的写入函数"""
+        self._stores[name] = prepare
+
+    def mark_dirty(self, name: str):
+        self._dirty.add(name)
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            await self._wakeup.wait()
+            try:
+                # 等待一个间隔，让这段时间内的变更合并成一次写入
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        names, self._dirty = self._dirty, set()
+        for name in names:
+            start = time.perf_counter()
+            try:
+                write = self._stores[name]()
+                if write is None:
+                    continue
+                await asyncio.to_thread(write)
+                self._failures.pop(name, None)
+                ok = True
+            except Exception as e:
+                print(f"后台写入 {name} 失败: {traceback.format_exc()}")
+                self._dirty.add(name)
+                self._failures[name] = self._failures.get(name, 0) + 1
+                ok = False
+            if self.on_write is not None:
+                self.on_write(name, time.perf_counter() - start, ok)
+        failed = [self._failures[name] for name in names if name in self._failures]
+        if failed and not self._stopping.is_set():
+            self._schedule_retry(max(failed))
+
+    def _schedule_retry(self, attempts: int):
+        """失败的存储已放回脏集合，按指数退避唤醒后台任务重试，不必等待下一次数据变更"""
+        delay = min(max(self.interval, 1) * 2 ** (attempts - 1), self.RETRY_MAX_BACKOFF)
+        if self._retry is not None:
+            self._retry.cancel()
+        self._retry = asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+
+    async def close(self):
+        """停止后台任务并完成最后一次落盘"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+class GroupShardStore:
+    """按群分片的数据文件：每个群一个 JSON 文件（当日配对 + 进阶功能使用次数），写入只涉及发生变化的群"""
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def path(self, group_id: str) -> Path:
+        return self.directory / f"{group_id}.json"
+
+    def load(self, group_id: str) -> Optional[dict]:
+        try:
+            with open(self.path(group_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"群 {group_id} 的数据分片加载失败: {traceback.format_exc()}")
+            return None
+
+    def load_all(self) -> Dict[str, dict]:
+        """读取全部分片，仅在迁移到 SQLite 时使用"""
+        if not self.directory.exists():
+            return {}
+        shards = {}
+        for path in self.directory.glob("*.json"):
+            shard = self.load(path.stem)
+            if shard is not None:
+                shards[path.stem] = shard
+        return shards
+
+    def group_ids(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        return [path.stem for path in self.directory.glob("*.json")]
+
+    def write(self, shards: Dict[str, Optional[str]], resets: Optional[Dict[str, bool]] = None,
+              prune_before: Optional[float] = None):
+        """写入或删除（值为 None）各群分片，在后台写入器的线程中执行。
+        resets 为待重置的群及是否保留使用次数：保留时清空配对后改写，否则删除分片；
+        prune_before 删除在该时间戳之后没有更新过的分片"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if prune_before is not None:
+            for path in self.directory.glob("*.json"):
+                if path.stem in shards:
+                    continue
+                try:
+                    if path.stat().st_mtime < prune_before:
+                        path.unlink()
+                except FileNotFoundError:
+                    pass
+        for group_id, keep_usage in (resets or {}).items():
+            shard = self.load(group_id) if keep_usage else None
+            if shard and shard.get("usage"):
+                shards.setdefault(group_id, json.dumps(
+                    {"date": shard.get("date"), "pairs": {}, "used": [], "usage": shard["usage"]},
+                    ensure_ascii=False))
+            else:
+                shards.setdefault(group_id, None)
+        for group_id, text in shards.items():
+            path = self.path(group_id)
+            if text is None:
+                path.unlink(missing_ok=True)
+                continue
+            temp_path = path.with_suffix(".tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            temp_path.replace(path)
+
+class SqliteStorage:
+    """SQLite 存储后端：每类数据一张带索引的表，写入只涉及发生变化的行"""
+    # 简单键值类数据：名称 -> (表名, 主键列, 值列)
+    TABLES = {
+        "cooling": ("cooling", ("cooling_key",), ("users", "expire_time")),
+        "blocked": ("blocked_users", ("user_id",), ()),
+        "breakups": ("breakup_window", ("date", "group_id", "user_id"), ("count",)),
+        "advanced_enabled": ("advanced_enabled", ("group_id",), ("enabled",)),
+        "advanced_usage": ("advanced_usage", ("date", "group_id", "user_id"), ("wish", "rob", "lock")),
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS groups (group_id TEXT PRIMARY KEY, date TEXT);
+        CREATE TABLE IF NOT EXISTS pairs (
+            group_id TEXT NOT NULL, user_id TEXT NOT NULL, partner_id TEXT NOT NULL,
+            display_name TEXT, is_initiator INTEGER, locked INTEGER,
+            PRIMARY KEY (group_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS used (
+            group_id TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (group_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS cooling (cooling_key TEXT PRIMARY KEY, users TEXT, expire_time TEXT);
+        CREATE INDEX IF NOT EXISTS idx_cooling_expire ON cooling (expire_time);
+        CREATE TABLE IF NOT EXISTS blocked_users (user_id TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS breakup_window (
+            date TEXT NOT NULL, group_id TEXT NOT NULL, user_id TEXT NOT NULL, count INTEGER NOT NULL,
+            PRIMARY KEY (date, group_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS advanced_enabled (group_id TEXT PRIMARY KEY, enabled INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS advanced_usage (
+            date TEXT NOT NULL, group_id TEXT NOT NULL, user_id TEXT NOT NULL,
+            wish INTEGER NOT NULL, rob INTEGER NOT NULL, lock INTEGER NOT NULL,
+            PRIMARY KEY (date, group_id, user_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 写入在后台写入器的线程中串行执行
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        # 每张键值表最近一次写入的内容，用于计算差异
+        self._shadow: Dict[str, Dict[tuple, tuple]] = {}
+
+    def close(self):
+        self._conn.close()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # ---------- 配对数据 ----------
+    def load_pair_data(self) -> Dict:
+        data = {}
+        for group_id, date in self._conn.execute("SELECT group_id, date FROM groups"):
+            data[group_id] = {"date": date, "pairs": {}, "used": []}
+        for group_id, user_id, partner_id, display_name, is_initiator, locked in self._conn.execute(
+                "SELECT group_id, user_id, partner_id, display_name, is_initiator, locked FROM pairs"):
+            entry = {"user_id": partner_id, "display_name": display_name}
+            if is_initiator is not None:
+                entry["is_initiator"] = bool(is_initiator)
+            if locked is not None:
+                entry["locked"] = bool(locked)
+            data.setdefault(group_id, {"date": None, "pairs": {}, "used": []})["pairs"][user_id] = entry
+        for group_id, user_id in self._conn.execute("SELECT group_id, user_id FROM used ORDER BY rowid"):
+            data.setdefault(group_id, {"date": None, "pairs": {}, "used": []})["used"].append(user_id)
+        return data
+
+    def apply_pair_ops(self, ops: List[dict]):
+        """在一个事务中应用配对日志记录，与 JSON 日志的重放语义一致"""
+        with self._conn:
+            for op in ops:
+                kind = op.get("op")
+                if kind == "clear":
+                    for table in ("groups", "pairs", "used"):
+                        self._conn.execute(f"DELETE FROM {table}")
+                elif kind == "group":
+                    self._delete_group(op["g"])
+                    if op.get("data") is not None:
+                        self._insert_group(op["g"], op["data"])
+                elif kind == "pairs":
+                    group_id = op["g"]
+                    self._conn.execute("INSERT OR IGNORE INTO groups (group_id, date) VALUES (?, ?)",
+                                       (group_id, op.get("date")))
+                    for uid, entry in op.get("pairs", {}).items():
+                        if entry is None:
+                            self._conn.execute("DELETE FROM pairs WHERE group_id = ? AND user_id = ?", (group_id, uid))
+                        else:
+                            self._insert_pair(group_id, uid, entry)
+                    for uid, is_used in op.get("used", {}).items():
+                        if is_used:
+                            self._conn.execute("INSERT OR IGNORE INTO used (group_id, user_id) VALUES (?, ?)",
+                                               (group_id, uid))
+                        else:
+                            self._conn.execute("DELETE FROM used WHERE group_id = ? AND user_id = ?", (group_id, uid))
+
+    def replace_pair_data(self, data: Dict):
+        with self._conn:
+            for table in ("groups", "pairs", "used"):
+                self._conn.execute(f"DELETE FROM {table}")
+            for group_id, group in data.items():
+                self._insert_group(group_id, group)
+
+    def _delete_group(self, group_id: str):
+        for table in ("groups", "pairs", "used"):
+            self._conn.execute(f"DELETE FROM {table} WHERE group_id = ?", (group_id,))
+
+    def _insert_group(self, group_id: str, group: dict):
+        self._conn.execute("INSERT OR REPLACE INTO groups (group_id, date) VALUES (?, ?)", (group_id, group.get("date")))
+        for uid, entry in group.get("pairs", {}).items():
+            self._insert_pair(group_id, uid, entry)
+        self._conn.executemany("INSERT OR IGNORE INTO used (group_id, user_id) VALUES (?, ?)",
+                               [(group_id, uid) for uid in group.get("used", [])])
+
+    def _insert_pair(self, group_id: str, uid: str, entry: dict):
+        is_initiator = entry.get("is_initiator")
+        locked = entry.get("locked")
+        self._conn.execute(
+            "INSERT OR REPLACE INTO pairs (group_id, user_id, partner_id, display_name, is_initiator, locked) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (group_id, uid, entry["user_id"], entry.get("display_name"),
+             None if is_initiator is None else int(is_initiator), None if locked is None else int(locked)))
+
+    # ---------- 键值类数据 ----------
+    def load_rows(self, name: str) -> Dict[tuple, tuple]:
+        table, keys, values = self.TABLES[name]
+        rows = {}
+        for row in self._conn.execute(f"SELECT {', '.join(keys + values)} FROM {table}"):
+            rows[tuple(row[:len(keys)])] = tuple(row[len(keys):])
+        self._shadow[name] = dict(rows)
+        return rows
+
+    def sync_rows(self, name: str, rows: Dict[tuple, tuple]):
+        """把表同步为 rows 的内容，只删除、写入有差异的行"""
+        table, keys, values = self.TABLES[name]
+        shadow = self._shadow.get(name, {})
+        removed = [k for k in shadow if k not in rows]
+        changed = [k + v for k, v in rows.items() if shadow.get(k) != v]
+        if not removed and not changed:
+            return
+        where = " AND ".join(f"{k} = ?" for k in keys)
+        columns = keys + values
+        with self._conn:
+            if removed:
+                self._conn.executemany(f"DELETE FROM {table} WHERE {where}", removed)
+            if changed:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    changed)
+        self._shadow[name] = rows
+
 # --------------- 插件主类 ---------------
 @register("DailyWife", "jmt059", "每日老婆插件", "v1.0.2", "https://github.com/jmt059/DailyWife")
 class DailyWifePlugin(Star):
-    # 用于跟踪等待确认开启进阶功能的用户和会话信息
-    ADVANCED_ENABLE_STATES: Dict[str, Dict[str, any]] = {}
+    # 用于跟踪等待确认开启进阶功能的用户和会话信息：{(group_id, user_id): {"session", "timestamp", "timer"}}
+    ADVANCED_ENABLE_STATES: Dict[Tuple[str, str], Dict[str, any]] = {}
+    # 有待确认请求的群及其请求数，供消息快速过滤
+    ADVANCED_PENDING_GROUPS: Dict[str, int] = {}
+    ADVANCED_CONFIRM_TIMEOUT = 30
 
     def __init__(self, context: Context, config: dict):
         super().__init__(context)
         self.config = config
         self.enable_advanced_globally = self.config.get("enable_advanced_globally", False)
-        self.pair_data = self._load_pair_data()
+        self._metrics = Metrics()
+        self._init_rollover()
+        self._init_persistence()
+        # 旧版 JSON 数据 = 快照(pair_data.json) + 追加日志(pair_data.journal)，启动时迁移为按群分片
+        self._pair_journal_buffer: List[dict] = []
+        self._pair_snapshot_needed = False
+        raw_pairs = self._load_pair_data()
         self.cooling_data = self._load_cooling_data()
+        self._rebuild_cooling_index()
         self.blocked_users = self._load_blocked_users()
-        self.advanced_enabled = self._load_data(ADVANCED_ENABLED_PATH, {})
-        self._init_napcat_config()
-        self._migrate_old_data()
-        self._clean_invalid_cooling_records()
+        self.advanced_enabled = self._load_advanced_enabled()
         self.breakup_counts = self._load_breakup_counts()
-
-        # 存储进阶功能每日使用计数：{group_id: {user_id: {"wish": int, "rob": int, "lock": int}}}
-        self.advanced_usage: Dict[str, Dict[str, Dict[str, int]]] = {}
-
-        # 启动定时任务检查进阶功能开启是否超时
-        asyncio.create_task(self._check_advanced_enable_timeout())
+        # 进阶功能每日使用计数，跨天时由 _daily_rollover 清空
+        self.advanced_usage = self._load_advanced_usage()
+        self._init_napcat_config()
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._avatar_cache = AvatarCache(
+            AVATAR_CACHE_DIR,
+            int(self.config.get("avatar_cache_memory_mb", 32) * 1024 * 1024),
+            self.config.get("avatar_cache_ttl_hours", 24) * 3600,
+        )
+        self._member_cache = MemberCache(self.config.get("member_cache_size", 200))
+        self._member_refreshing: Set[str] = set()
+        self._member_flight = SingleFlight()
+        self._shard_flight = SingleFlight()
+        # 成员索引（默认关闭）：由群成员变动通知原地修补，定期全量校准，开启后缓存不再按有效期过期，
+        # 只有确认协议端会上报群成员变动通知时才应开启
+        self._member_index_enabled = self.config.get("member_index_enabled", False)
+        # 成员列表快照：启动时只扫描文件头，不发起任何网络请求
+        self._member_snapshots = MemberSnapshotStore(MEMBER_SNAPSHOT_DIR)
+        self._member_snapshot_max_age = self.config.get("member_snapshot_max_age_hours", 24) * 3600
+        if self._member_snapshot_max_age > 0:
+            self._member_snapshots.scan()
+        # 配置了抽取种子时使用固定种子，便于测试复现抽取结果
+        draw_seed = self.config.get("draw_seed", "")
+        self._matcher = WifeMatcher(random.Random(draw_seed) if draw_seed != "" else None)
+        # 成员池引用了缓存中的成员列表，群被淘汰时一并释放，使成员缓存上限同样约束成员池
+        self._member_cache.on_evict = self._matcher.invalidate
+        self._group_locks = GroupLocks()
+        # 各群最近一次全群配对的结果：group_id -> (日期, 结果行)，供分页查看
+        self._bulk_pair_results: Dict[str, Tuple[str, List[str]]] = {}
+        self._migrate_old_data(raw_pairs)
+        self.pair_data = PairStore.from_json(raw_pairs)
+        if self._json_migration_pending:
+            self._migrate_json_to_sqlite()
+        # 补做停机期间错过的跨天重置
+        self._daily_rollover()
+        if self._shards is not None:
+            self._migrate_json_to_shards()
+
+        self._rollover_task = asyncio.create_task(self._daily_reset_task())
+        self._metrics_task: Optional[asyncio.Task] = None
+        if self.config.get("metrics_prometheus_path"):
+            self._metrics_task = asyncio.create_task(self._metrics_dump_task())
+        self._resync_task: Optional[asyncio.Task] = None
+        if self._member_index_enabled and self.config.get("member_resync_interval", 3600) > 0:
+            self._resync_task = asyncio.create_task(self._member_resync_task())
+        self._evict_task: Optional[asyncio.Task] = None
+        if self._shards is not None and self.config.get("group_idle_evict_minutes", 30) > 0:
+            self._evict_task = asyncio.create_task(self._shard_evict_task())
+        self._avatar_sweep_task: Optional[asyncio.Task] = None
+        if self._avatar_cache.ttl > 0:
+            self._avatar_sweep_task = asyncio.create_task(self._avatar_cache_sweep_task())
+        self._persister.start()
 
     # --------------- 数据迁移 ---------------
-    def _migrate_old_data(self):
+    def _migrate_old_data(self, pair_data: Dict):
+        """在原始 JSON 结构上规整旧格式"""
         try:
             if "block_list" in self.config:
                 self.blocked_users = set(map(str, self.config["block_list"]))
                 self._save_blocked_users()
                 del self.config["block_list"]
-            for group_id in list(self.pair_data.keys()):
-                pairs = self.pair_data[group_id].get("pairs", {})
-                for uid in pairs:
-                    if "is_initiator" not in pairs[uid]:
-                        pairs[uid]["is_initiator"] = True
-                if isinstance(pairs, dict) and all(isinstance(v, str) for v in pairs.values()):
-                    new_pairs = {}
-                    for user_id, target_id in pairs.items():
-                        new_pairs[user_id] = {
-                            "user_id": target_id,
-                            "display_name": f"未知用户({target_id})"
-                        }
-                        if target_id in pairs:
-                            new_pairs[target_id] = {
-                                "user_id": user_id,
-                                "display_name": f"未知用户({user_id})"
-                            }
-                    self.pair_data[group_id]["pairs"] = new_pairs
-                    self._save_pair_data()
+            for group in pair_data.values():
+                self._migrate_group_data(group)
         except Exception as e:
             print(f"数据迁移失败: {traceback.format_exc()}")
 
+    @staticmethod
+    def _migrate_group_data(group: dict):
+        """规整单个群的旧格式配对数据（整体加载和按群分片载入共用）"""
+        pairs = group.get("pairs", {})
+        # used 在内存中是集合，旧文件里的列表可能含重复项
+        used = group.get("used", [])
+        if len(set(map(str, used))) != len(used):
+            group["used"] = sorted(set(map(str, used)))
+        for uid in pairs:
+            if "is_initiator" not in pairs[uid]:
+                pairs[uid]["is_initiator"] = True
+        if isinstance(pairs, dict) and all(isinstance(v, str) for v in pairs.values()):
+            new_pairs = {}
+            for user_id, target_id in pairs.items():
+                new_pairs[user_id] = {
+                    "user_id": target_id,
+                    "display_name": f"未知用户({target_id})"
+                }
+                if target_id in pairs:
+                    new_pairs[target_id] = {
+                        "user_id": user_id,
+                        "display_name": f"未知用户({user_id})"
+                    }
+            group["pairs"] = new_pairs
+
+    def _migrate_json_to_sqlite(self):
+        """一次性把已有 JSON 数据导入 SQLite（在 _migrate_old_data 规整旧格式之后执行）"""
+        try:
+            self._sqlite.replace_pair_data(self.pair_data.to_json())
+            self._sqlite.sync_rows("cooling", self._cooling_rows())
+            self._sqlite.sync_rows("blocked", self._blocked_rows())
+            self._sqlite.sync_rows("breakups", self._breakup_rows())
+            self._sqlite.sync_rows("advanced_enabled", self._advanced_enabled_rows())
+            self._sqlite.sync_rows("advanced_usage", self.advanced_usage.rows())
+            self._sqlite.set_meta("json_migrated", datetime.now().isoformat())
+            self._json_migration_pending = False
+            print(f"✅ 已将 JSON 数据迁移到 SQLite：{len(self.pair_data)} 个群组")
+        except Exception as e:
+            # 迁移未完成时不切换后端：本次运行继续读写 JSON 文件，下次启动重新从 JSON 完整导入，
+            # 避免新数据写进半迁移的数据库后又被 JSON 中的旧数据覆盖
+            print(f"迁移 JSON 数据到 SQLite 失败，本次运行继续使用 JSON 存储: {traceback.format_exc()}")
+            self._sqlite.close()
+            self._sqlite = None
+            self._json_migration_pending = False
+            self._shards = GroupShardStore(GROUP_DATA_DIR)
+            now = time.monotonic()
+            for gid in self.pair_data:
+                self._group_access[gid] = now
+
+    def _migrate_json_to_shards(self):
+        """一次性把旧版的整体文件（pair_data.json 及日志、advanced_usage.json）拆分为按群分片"""
+        legacy = [path for path in (PAIR_DATA_PATH, PAIR_JOURNAL_PATH, ADVANCED_USAGE_PATH) if path.exists()]
+        if not legacy:
+            return
+        try:
+            groups = set(self.pair_data) | {gid for _, gid, _ in self.advanced_usage.rows()}
+            self._shards.write({gid: self._shard_json(gid) for gid in groups})
+            for path in legacy:
+                path.replace(path.with_name(path.name + ".migrated"))
+            now = time.monotonic()
+            for gid in self.pair_data:
+                self._group_access[gid] = now
+            print(f"✅ 已将配对数据拆分为 {len(groups)} 个群分片")
+        except Exception as e:
+            print(f"拆分配对数据失败: {traceback.format_exc()}")
+
     # --------------- 初始化方法 ---------------
+    def _init_rollover(self):
+        tz_name = self.config.get("timezone") or ""
+        try:
+            # 未配置时区时使用系统本地时间
+            self._tz = ZoneInfo(tz_name) if tz_name else None
+        except Exception as e:
+            raise RuntimeError(f"时区配置错误：{tz_name}")
+        self._today = ""
+        self._next_rollover_ts = 0.0
+
+    def _now(self) -> datetime:
+        """配置时区下的当前时间，冷静期与临时屏蔽的到期时间都以此计算，与每日重置使用同一时钟。
+        去掉时区信息，与已保存的到期时间格式一致"""
+        return datetime.now(self._tz).replace(tzinfo=None)
+
+    def _init_persistence(self):
+        backend = self.config.get("storage_backend", "json")
+        self._sqlite: Optional[SqliteStorage] = None
+        self._json_migration_pending = False
+        if backend == "sqlite":
+            self._sqlite = SqliteStorage(SQLITE_DB_PATH)
+            # 数据库尚未导入过 JSON 数据时，本次启动仍从 JSON 文件加载
+            self._json_migration_pending = self._sqlite.get_meta("json_migrated") is None
+        elif backend != "json":
+            raise RuntimeError(f"未知的存储后端：{backend}")
+        # JSON 后端按群分片存储当日配对与进阶功能使用次数，首次使用时载入，长时间无人使用时移出内存
+        self._shards: Optional[GroupShardStore] = GroupShardStore(GROUP_DATA_DIR) if self._sqlite is None else None
+        self._dirty_groups: Set[str] = set()
+        self._group_access: Dict[str, float] = {}
+        self._shard_prune_before: Optional[float] = None
+        self._pending_shards: Optional[Dict[str, dict]] = None
+        # 重置后尚未改写的分片：group_id -> 是否保留进阶功能使用次数；载入时按重置后的内容处理
+        self._pending_resets: Dict[str, bool] = {}
+        # 已离开脏集合、分片仍在线程中写入的群，写完之前不能移出内存
+        self._writing_groups: Set[str] = set()
+        self._persister = CoalescingWriter(self.config.get("persist_interval", 2))
+        self._persister.on_write = self._on_persist_write
+        self._persister.register("pairs", self._prepare_pair_write)
+        self._persister.register("cooling", self._prepare_cooling_write)
+        self._persister.register("blocked", self._prepare_blocked_write)
+        self._persister.register("breakups", self._prepare_breakups_write)
+        self._persister.register("advanced_enabled", self._prepare_advanced_enabled_write)
+        self._persister.register("advanced_usage", self._prepare_advanced_usage_write)
+
+    def _use_sqlite(self) -> bool:
+        return self._sqlite is not None and not self._json_migration_pending
+
     def _init_napcat_config(self):
         try:
             # 支持逗号分隔的多个主机
             hosts_str = self.config.get("napcat_host") or "127.0.0.1:3000"
             self.napcat_hosts = [host.strip() for host in hosts_str.split(",")]
-            self.current_host_index = 0
             self.timeout = self.config.get("request_timeout") or 10
             
             # 验证每个主机格式
@@ -106,33 +1514,92 @@ class DailyWifePlugin(Star):
                 if not parsed.hostname or not parsed.port:
                     raise ValueError(f"无效的Napcat地址格式: {host}")
                     
+            self._host_manager = NapcatHostManager(
+                self.napcat_hosts,
+                failure_threshold=self.config.get("napcat_failure_threshold", 3),
+                base_backoff=self.config.get("napcat_circuit_backoff", 5),
+                max_backoff=self.config.get("napcat_circuit_max_backoff", 300),
+            )
             print(f"✅ 已加载 {len(self.napcat_hosts)} 个Napcat主机: {self.napcat_hosts}")
             
         except Exception as e:
             raise RuntimeError(f"Napcat配置错误：{e}")
 
-    def _get_current_napcat_host(self):
-        """获取当前要使用的Napcat主机（轮询方式）"""
-        if not hasattr(self, 'napcat_hosts') or not self.napcat_hosts:
-            return "127.0.0.1:3000"  # 默认回退
-        
-        host = self.napcat_hosts[self.current_host_index]
-        # 轮询到下一个主机
-        self.current_host_index = (self.current_host_index + 1) % len(self.napcat_hosts)
-        return host
-
     # --------------- 数据管理 ---------------
     def _load_pair_data(self) -> Dict:
+        if self._use_sqlite():
+            return self._sqlite.load_pair_data()
+        data = {}
         try:
             if PAIR_DATA_PATH.exists():
                 with open(PAIR_DATA_PATH, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            return {}
+                    data = json.load(f)
         except Exception as e:
             print(f"配对数据加载失败: {traceback.format_exc()}")
-            return {}
+            data = {}
+        self._replay_pair_journal(PAIR_JOURNAL_PATH, data)
+        if self._json_migration_pending:
+            # 改用 SQLite 前的数据可能已经按群分片
+            for group_id, shard in self._legacy_shards().items():
+                data[group_id] = {k: v for k, v in shard.items() if k != "usage"}
+        return data
+
+    def _legacy_shards(self) -> Dict[str, dict]:
+        """迁移到 SQLite 时一次性读取全部群分片"""
+        if self._pending_shards is None:
+            self._pending_shards = GroupShardStore(GROUP_DATA_DIR).load_all()
+        return self._pending_shards
+
+    def _replay_pair_journal(self, path: Path, data: Dict) -> int:
+        if not path.exists():
+            return 0
+        count = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        op = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中途崩溃只会损坏最后一行，跳过即可
+                        print(f"⚠️ 跳过损坏的配对日志记录: {line[:50]}")
+                        continue
+                    self._apply_pair_op(data, op)
+                    count += 1
+        except Exception as e:
+            print(f"配对日志重放失败: {traceback.format_exc()}")
+        return count
+
+    @staticmethod
+    def _apply_pair_op(data: Dict, op: dict):
+        """将一条日志记录应用到配对数据上（记录的是结果值，重复应用不影响结果）"""
+        kind = op.get("op")
+        if kind == "clear":
+            data.clear()
+        elif kind == "group":
+            if op.get("data") is None:
+                data.pop(op["g"], None)
+            else:
+                data[op["g"]] = op["data"]
+        elif kind == "pairs":
+            group = data.setdefault(op["g"], {"date": op.get("date"), "pairs": {}, "used": []})
+            for uid, entry in op.get("pairs", {}).items():
+                if entry is None:
+                    group["pairs"].pop(uid, None)
+                else:
+                    group["pairs"][uid] = entry
+            for uid, is_used in op.get("used", {}).items():
+                if is_used and uid not in group["used"]:
+                    group["used"].append(uid)
+                elif not is_used and uid in group["used"]:
+                    group["used"].remove(uid)
 
     def _load_cooling_data(self) -> Dict:
+        if self._use_sqlite():
+            return { k: {"users": json.loads(users), "expire_time": datetime.fromisoformat(expire)}
+                     for (k,), (users, expire) in self._sqlite.load_rows("cooling").items() }
         try:
             if COOLING_DATA_PATH.exists():
                 with open(COOLING_DATA_PATH, "r", encoding="utf-8") as f:
@@ -145,6 +1612,8 @@ class DailyWifePlugin(Star):
             return {}
 
     def _load_blocked_users(self) -> Set[str]:
+        if self._use_sqlite():
+            return { uid for (uid,) in self._sqlite.load_rows("blocked") }
         try:
             if BLOCKED_USERS_PATH.exists():
                 with open(BLOCKED_USERS_PATH, "r", encoding="utf-8") as f:
@@ -154,6 +1623,30 @@ class DailyWifePlugin(Star):
             print(f"屏蔽列表加载失败: {traceback.format_exc()}")
             return set()
 
+    def _load_advanced_enabled(self) -> Dict[str, bool]:
+        if self._use_sqlite():
+            return { gid: bool(enabled) for (gid,), (enabled,) in self._sqlite.load_rows("advanced_enabled").items() }
+        return self._load_data(ADVANCED_ENABLED_PATH, {})
+
+    def _load_advanced_usage(self) -> AdvancedUsage:
+        if self._use_sqlite():
+            rows = self._sqlite.load_rows("advanced_usage")
+            # 只保留最近一天的计数，更早的行在下次写入时被删除
+            latest = max((date for date, _, _ in rows), default="")
+            return AdvancedUsage.from_rows(latest, rows)
+        try:
+            usage = AdvancedUsage.from_json(self._load_data(ADVANCED_USAGE_PATH, {}))
+            if self._json_migration_pending:
+                for group_id, shard in self._legacy_shards().items():
+                    if shard.get("usage") and (shard.get("date") or "") >= usage.date:
+                        if shard["date"] > usage.date:
+                            usage.reset(shard["date"])
+                        usage.load_group(group_id, shard["usage"])
+            return usage
+        except Exception as e:
+            print(f"进阶功能使用次数加载失败: {traceback.format_exc()}")
+            return AdvancedUsage()
+
     def _load_data(self, path: str, default=None):
         try:
             with open(path, 'r', encoding='utf-8') as f:
@@ -167,64 +1660,207 @@ class DailyWifePlugin(Star):
             print(f"加载数据文件 {path} 失败: {traceback.format_exc()}")
             return default
 
-    def _save_pair_data(self):
-        try:
-            if not PAIR_DATA_PATH.parent.exists():
-                PAIR_DATA_PATH.parent.mkdir(parents=True, exist_ok=True)
-            temp_path = PAIR_DATA_PATH.with_suffix(".tmp")
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(self.pair_data, f, ensure_ascii=False, indent=2)
-            temp_path.replace(PAIR_DATA_PATH)
-        except Exception as e:
-            print(f"保存配对数据失败: {traceback.format_exc()}")
-            raise
+    def _prepare_pair_write(self) -> Optional[Callable[[], None]]:
+        if self._shards is not None:
+            return self._prepare_shard_write()
+        if self._pair_snapshot_needed:
+            snapshot = json.dumps(self.pair_data.to_json(), ensure_ascii=False)
+            self._pair_journal_buffer = []
+            self._pair_snapshot_needed = False
+            return lambda: self._sqlite.replace_pair_data(json.loads(snapshot))
+        if not self._pair_journal_buffer:
+            return None
+        ops, self._pair_journal_buffer = self._pair_journal_buffer, []
+        return lambda: self._sqlite.apply_pair_ops(ops)
+
+    def _prepare_shard_write(self) -> Optional[Callable[[], None]]:
+        """只序列化发生变化的群：在事件循环内序列化，在线程中写入各自的分片"""
+        groups, self._dirty_groups = self._dirty_groups, set()
+        prune_before, self._shard_prune_before = self._shard_prune_before, None
+        resets = {gid: keep for gid, keep in self._pending_resets.items() if gid not in groups}
+        if not groups and not resets and prune_before is None:
+            return None
+        shards = {gid: self._shard_json(gid) for gid in groups}
+        self._writing_groups.update(shards)
+        loop = asyncio.get_running_loop()
+
+        def write():
+            try:
+                self._shards.write(dict(shards), resets, prune_before)
+            except Exception:
+                # 写入失败的群已离开脏集合，回到事件循环中放回，由后台写入器重试
+                loop.call_soon_threadsafe(self._requeue_shards, list(shards), prune_before)
+                raise
+            else:
+                if resets:
+                    loop.call_soon_threadsafe(self._finish_resets, resets)
+            finally:
+                loop.call_soon_threadsafe(self._writing_groups.difference_update, list(shards))
+        return write
+
+    def _requeue_shards(self, group_ids: List[str], prune_before: Optional[float]):
+        self._dirty_groups.update(group_ids)
+        if prune_before is not None and self._shard_prune_before is None:
+            self._shard_prune_before = prune_before
+        self._persister.mark_dirty("pairs")
+
+    def _finish_resets(self, resets: Dict[str, bool]):
+        """分片已按重置结果改写，之后再载入时直接使用文件内容"""
+        for group_id, keep_usage in resets.items():
+            if self._pending_resets.get(group_id) == keep_usage:
+                del self._pending_resets[group_id]
+
+    def _shard_json(self, group_id: str) -> Optional[str]:
+        """序列化单个群的分片；群既没有配对数据也没有使用次数时返回 None（删除分片）"""
+        group = self.pair_data.get(group_id)
+        if group is not None and not group.pairs and not group.used:
+            # 空群记录与不存在等价
+            group = None
+        usage = self.advanced_usage.group_json(group_id)
+        if group is None and not usage:
+            return None
+        data = group.to_json() if group is not None else {"date": self.advanced_usage.date, "pairs": {}, "used": []}
+        if usage and self.advanced_usage.date == data["date"]:
+            data["usage"] = usage
+        return json.dumps(data, ensure_ascii=False)
+
+    def _mark_group_dirty(self, group_id: str):
+        self._dirty_groups.add(group_id)
+        self._persister.mark_dirty("pairs")
+
+    def _append_pair_journal(self, op: dict):
+        self._pair_journal_buffer.append(op)
+        self._persister.mark_dirty("pairs")
+
+    def _request_pair_snapshot(self):
+        """整体替换配对数据后调用，下次落盘时写入完整快照"""
+        self._pair_snapshot_needed = True
+        self._persister.mark_dirty("pairs")
+
+    def _record_pair_change(self, group_id: str, user_ids):
+        """记录若干用户在某群的配对结果，替代整份配对数据重写"""
+        if self._shards is not None:
+            self._mark_group_dirty(group_id)
+            return
+        group = self.pair_data.get(group_id)
+        if group is None:
+            return
+        records = {uid: group.partner(uid) for uid in user_ids}
+        self._append_pair_journal({
+            "op": "pairs",
+            "g": group_id,
+            "date": group.date,
+            "pairs": {str(uid): record.to_json() if record else None for uid, record in records.items()},
+            "used": {str(uid): group.is_used(uid) for uid in records},
+        })
+
+    def _record_group_change(self, group_id: str):
+        """记录整个群的配对数据（用于每日重置或删除群记录）"""
+        if self._shards is not None:
+            self._mark_group_dirty(group_id)
+            return
+        group = self.pair_data.get(group_id)
+        self._append_pair_journal({"op": "group", "g": group_id, "data": group.to_json() if group else None})
 
     def _save_cooling_data(self):
-        temp_data = { k: {"users": v["users"], "expire_time": v["expire_time"].isoformat()}
-                      for k, v in self.cooling_data.items() }
-        self._save_data(COOLING_DATA_PATH, temp_data)
+        self._persister.mark_dirty("cooling")
 
     def _save_blocked_users(self):
-        self._save_data(BLOCKED_USERS_PATH, list(self.blocked_users))
+        self._persister.mark_dirty("blocked")
 
-    def _save_data(self, path: Path, data: dict):
-        try:
-            temp_path = path.with_suffix(".tmp")
-            temp_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(temp_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            temp_path.replace(path)
-        except Exception as e:
-            print(f"数据保存失败: {traceback.format_exc()}")
+    def _save_breakup_counts(self):
+        self._persister.mark_dirty("breakups")
+
+    def _save_advanced_enabled(self):
+        self._persister.mark_dirty("advanced_enabled")
+
+    def _save_advanced_usage(self, group_id: Optional[str] = None):
+        if self._shards is not None:
+            # 使用次数随所在群的分片写入；跨天或全部重置时分片已一并处理
+            if group_id is not None:
+                self._mark_group_dirty(group_id)
+            return
+        self._persister.mark_dirty("advanced_usage")
+
+    def _prepare_cooling_write(self) -> Callable[[], None]:
+        if self._sqlite is not None:
+            return self._sqlite_writer("cooling", self._cooling_rows())
+        temp_data = { k: {"users": list(v["users"]), "expire_time": v["expire_time"].isoformat()}
+                      for k, v in self.cooling_data.items() }
+        return self._json_writer(COOLING_DATA_PATH, temp_data)
+
+    def _prepare_blocked_write(self) -> Callable[[], None]:
+        if self._sqlite is not None:
+            return self._sqlite_writer("blocked", self._blocked_rows())
+        return self._json_writer(BLOCKED_USERS_PATH, list(self.blocked_users))
+
+    def _prepare_breakups_write(self) -> Callable[[], None]:
+        if self._sqlite is not None:
+            return self._sqlite_writer("breakups", self._breakup_rows())
+        return self._json_writer(BREAKUP_COUNT_PATH, self.breakup_counts.to_json())
+
+    def _prepare_advanced_enabled_write(self) -> Callable[[], None]:
+        if self._sqlite is not None:
+            return self._sqlite_writer("advanced_enabled", self._advanced_enabled_rows())
+        return self._json_writer(ADVANCED_ENABLED_PATH, dict(self.advanced_enabled))
+
+    def _prepare_advanced_usage_write(self) -> Optional[Callable[[], None]]:
+        if self._sqlite is None:
+            return None
+        return self._sqlite_writer("advanced_usage", self.advanced_usage.rows())
 
-    def _load_breakup_counts(self) -> Dict[str, Dict[str, int]]:
+    def _cooling_rows(self) -> Dict[tuple, tuple]:
+        return { (k,): (json.dumps(v["users"]), v["expire_time"].isoformat()) for k, v in self.cooling_data.items() }
+
+    def _blocked_rows(self) -> Dict[tuple, tuple]:
+        return { (uid,): () for uid in self.blocked_users }
+
+    def _breakup_rows(self) -> Dict[tuple, tuple]:
+        return self.breakup_counts.rows()
+
+    def _advanced_enabled_rows(self) -> Dict[tuple, tuple]:
+        return { (gid,): (int(bool(enabled)),) for gid, enabled in self.advanced_enabled.items() }
+
+    def _sqlite_writer(self, name: str, rows: Dict[tuple, tuple]) -> Callable[[], None]:
+        return lambda: self._sqlite.sync_rows(name, rows)
+
+    def _json_writer(self, path: Path, data) -> Callable[[], None]:
+        """data 必须是调用方独占的拷贝，写入函数会在线程中执行"""
+        return lambda: self._save_data(path, data)
+
+    def _save_data(self, path: Path, data: dict):
+        """写入失败时抛出异常，由后台写入器记录错误并放回脏集合重试"""
+        temp_path = path.with_suffix(".tmp")
+        temp_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        temp_path.replace(path)
+
+    def _load_breakup_counts(self) -> BreakupCounter:
+        window_days = self.config.get("breakup_window_days", 1)
+        if self._use_sqlite():
+            return BreakupCounter.from_rows(window_days, self._sqlite.load_rows("breakups"))
         try:
+            rows = {}
             if BREAKUP_COUNT_PATH.exists():
                 with open(BREAKUP_COUNT_PATH, "r", encoding="utf-8") as f:
                     data = json.load(f)
-                    return { date: {k: int(v) for k, v in counts.items()} for date, counts in data.items() }
-            return {}
+                for date, groups in data.items():
+                    for gid, users in groups.items():
+                        # 旧版本按天全局计数（{日期: {QQ号: 次数}}），无法归属到群，直接丢弃
+                        if isinstance(users, dict):
+                            rows.update({ (date, gid, uid): (int(count),) for uid, count in users.items() })
+            return BreakupCounter.from_rows(window_days, rows)
         except Exception as e:
             print(f"分手次数数据加载失败: {traceback.format_exc()}")
-            return {}
+            return BreakupCounter(window_days)
 
-    def _parse_display_info(self, raw_info: str) -> Tuple[str, str]:
-        try:
-            if '(' in raw_info and raw_info.endswith(')'):
-                name_part, qq_part = raw_info.rsplit('(', 1)
-                return name_part.strip(), qq_part[:-1]
-            if '(' not in raw_info:
-                return raw_info, "未知QQ号"
-            parts = raw_info.split('(')
-            if len(parts) >= 2:
-                return parts[0].strip(), parts[-1].replace(')', '')
-            return raw_info, "解析失败"
-        except Exception as e:
-            print(f"解析display_info失败：{raw_info} | 错误：{str(e)}")
-            return raw_info, "解析异常"
+    def _breakup_window_label(self) -> str:
+        window_days = self.breakup_counts.window_days
+        return "今日" if window_days == 1 else f"近{window_days}天"
 
-    def _format_display_info(self, raw_info: str) -> str:
-        nickname, qq = self._parse_display_info(raw_info)
+    def _format_member(self, nickname: str, qq) -> str:
+        """按配置截断昵称，格式化为 昵称(QQ号)"""
         max_len = self.config.get("display_name_max_length", 10)
         safe_nickname = nickname.replace("\n", "").replace("\r", "").strip()
         formatted_nickname = safe_nickname[:max_len] + "……" if len(safe_nickname) > max_len else safe_nickname
@@ -251,11 +1887,13 @@ class DailyWifePlugin(Star):
             return
         arg = args[0]
         if arg == "-a":
-            self.pair_data = {}
+            await self._reset_pairs(keep_usage=False)
+            # 在扫描分片目录之后清空，扫描期间载入的群的使用次数一并清除
+            self.advanced_usage.reset(self._today)
             self.cooling_data = {}
+            self._rebuild_cooling_index()
             self.blocked_users = set()
-            self.breakup_counts = {}
-            self.advanced_usage = {}
+            self.breakup_counts = BreakupCounter(self.breakup_counts.window_days)
             self.advanced_enabled = {}
             self._save_all_data()
             yield event.plain_result("✅ 已重置所有数据")
@@ -263,17 +1901,23 @@ class DailyWifePlugin(Star):
             group_id = str(event.message_obj.group_id)
             self.advanced_enabled.pop(group_id, None)
             yield event.plain_result("✅ 已重置本群进阶功能状态")
+        elif arg == "-p":
+            await self._reset_pairs()
+            yield event.plain_result("✅ 已重置 配对数据")
         elif arg.isdigit():
             group_id = str(arg)
+            if self._shards is not None and group_id not in self.pair_data:
+                await self._load_group_shard_shared(group_id)
             if group_id in self.pair_data:
-                del self.pair_data[group_id]
-                self._save_pair_data()
+                # 留下空记录而不是删除，避免落盘前被再次从分片载入旧数据
+                self.pair_data[group_id] = GroupPairs(self._today)
+                self._record_group_change(group_id)
+                self._matcher.invalidate(group_id)
                 yield event.plain_result(f"✅ 已重置群组 {group_id} 的配对数据")
             else:
                 yield event.plain_result(f"⚠ 未找到群组 {group_id} 的记录")
         else:
             option_map = {
-                "-p": ("配对数据", lambda: self._reset_pairs()),
                 "-c": ("冷静期数据", lambda: self._reset_cooling()),
                 "-b": ("屏蔽名单", lambda: self._reset_blocks()),
                 "-d": ("分手记录", lambda: self._reset_breakups())
@@ -285,29 +1929,50 @@ class DailyWifePlugin(Star):
             reset_func()
             yield event.plain_result(f"✅ 已重置 {opt_name}")
 
-    def _reset_pairs(self):
-        self.pair_data = {}
-        self._save_pair_data()
+    async def _reset_pairs(self, keep_usage: bool = True):
+        if self._shards is not None:
+            await self._reset_group_shards(keep_usage)
+        else:
+            self.pair_data = PairStore()
+            self._request_pair_snapshot()
+        self._matcher.invalidate()
+
+    async def _reset_group_shards(self, keep_usage: bool):
+        """分片存储下重置所有群的配对：内存中的群换成空记录，未载入的群记为待重置，由后台写入器改写分片。
+        keep_usage 为 False 时连同进阶功能使用次数一起清除。分片目录随群数增长，在线程中扫描"""
+        group_ids = await asyncio.to_thread(self._shards.group_ids)
+        # 扫描期间载入内存的群由下面的循环处理；仍在读取中的群会在读取完成后取走待重置标记
+        for group_id in group_ids:
+            if group_id not in self.pair_data:
+                # 已有的“删除”标记不能被“保留使用次数”覆盖
+                self._pending_resets[group_id] = keep_usage and self._pending_resets.get(group_id, True)
+        for group_id in self.pair_data:
+            self.pair_data[group_id] = GroupPairs(self._today)
+            self._mark_group_dirty(group_id)
+        self._persister.mark_dirty("pairs")
 
     def _reset_cooling(self):
         self.cooling_data = {}
+        self._rebuild_cooling_index()
         self._save_cooling_data()
 
     def _reset_blocks(self):
         self.blocked_users = set()
         self._save_blocked_users()
         self.cooling_data = { k: v for k, v in self.cooling_data.items() if not k.startswith("block_") }
+        self._rebuild_cooling_index()
         self._save_cooling_data()
 
     def _reset_breakups(self):
-        self.breakup_counts = {}
-        self._save_data(BREAKUP_COUNT_PATH, self.breakup_counts)
+        self.breakup_counts = BreakupCounter(self.breakup_counts.window_days)
+        self._save_breakup_counts()
 
     def _save_all_data(self):
-        self._save_pair_data()
         self._save_cooling_data()
         self._save_blocked_users()
-        self._save_data(BREAKUP_COUNT_PATH, self.breakup_counts)
+        self._save_breakup_counts()
+        self._save_advanced_enabled()
+        self._save_advanced_usage()
 
     @filter.command("屏蔽")
     @filter.permission_type(filter.PermissionType.ADMIN)
@@ -318,11 +1983,16 @@ class DailyWifePlugin(Star):
             return
         qq = parts[1]
         qq_str = str(qq)
-        if qq_str in self.blocked_users:
+        auto_key = f"block_{qq_str}"
+        if qq_str in self.blocked_users and auto_key not in self.cooling_data:
             yield event.plain_result(f"ℹ️ 用户 {qq} 已在屏蔽列表中")
         else:
             self.blocked_users.add(qq_str)
             self._save_blocked_users()
+            if auto_key in self.cooling_data:
+                # 分手超限的临时屏蔽改为手动屏蔽，不再随记录到期解除
+                del self.cooling_data[auto_key]
+                self._save_cooling_data()
             yield event.plain_result(f"✅ 已屏蔽用户 {qq}")
 
     @filter.command("冷静期")
@@ -339,42 +2009,619 @@ class DailyWifePlugin(Star):
         self.config["default_cooling_hours"] = hours
         yield event.plain_result(f"✅ 已设置默认冷静期时间为 {hours} 小时")
 
+    @filter.command("刷新群成员")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def refresh_members_command(self, event: AstrMessageEvent):
+        parts = event.message_str.split()
+        if len(parts) >= 2 and parts[1] == "-a":
+            count = self._member_cache.invalidate()
+            self._member_snapshots.forget()
+            yield event.plain_result(f"✅ 已清除 {count} 个群的成员缓存")
+            return
+        if len(parts) >= 2 and not parts[1].isdigit():
+            yield event.plain_result("❌ 参数错误\n格式：刷新群成员 [群号/-a]")
+            return
+        group_id = parts[1] if len(parts) >= 2 else str(event.message_obj.group_id)
+        self._member_cache.invalidate(group_id)
+        self._member_snapshots.forget(group_id)
+        yield event.plain_result(f"✅ 已清除群组 {group_id} 的成员缓存，下次抽取时将重新获取")
+
+    # --------------- 网络请求 ---------------
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        """插件共用的 HTTP 会话，首次使用时创建，按主机限制连接池大小并复用连接"""
+        if self._http_session is None or self._http_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.get("http_pool_size", 100),
+                limit_per_host=self.config.get("http_pool_per_host", 10),
+                ttl_dns_cache=300,
+            )
+            self._http_session = aiohttp.ClientSession(connector=connector)
+        return self._http_session
+
+    async def _download_avatar(self, user_id: str) -> Optional[Image]:
+        """获取QQ头像并构造图片消息段，依次查找内存缓存、磁盘缓存和网络，失败时返回 None"""
+        avatar_size = self.config.get("avatar_size", 100) # 从配置中获取头像尺寸，默认为 100
+        user_id = str(user_id)
+        cache = self._avatar_cache
+        use_cache = cache.ttl > 0
+        send_file = use_cache and self.config.get("avatar_send_local_file", False)
+        try:
+            if use_cache:
+                if send_file:
+                    path = await asyncio.to_thread(cache.fresh_path, user_id, avatar_size)
+                    if path is not None:
+                        self._metrics.incr("cache_requests_total", cache="avatar", result="disk")
+                        return Image.fromFileSystem(str(path))
+                image_data = cache.get(user_id, avatar_size)
+                result = "memory"
+                if image_data is None:
+                    result = "disk"
+                    cached = await asyncio.to_thread(cache.read_disk, user_id, avatar_size)
+                    if cached is not None:
+                        image_data, mtime = cached
+                        cache.remember(user_id, avatar_size, image_data, mtime)
+                if image_data is not None:
+                    self._metrics.incr("cache_requests_total", cache="avatar", result=result)
+                    return Image.fromBytes(image_data)
+        except Exception as e:
+            print(f"读取头像缓存异常: {traceback.format_exc()}")
+
+        self._metrics.incr("cache_requests_total", cache="avatar", result="miss")
+        image_data = await self._fetch_avatar(user_id, avatar_size)
+        if image_data is None:
+            return None
+        if not use_cache:
+            return Image.fromBytes(image_data)
+        cache.remember(user_id, avatar_size, image_data)
+        try:
+            path = await asyncio.to_thread(cache.write_disk, user_id, avatar_size, image_data)
+            if send_file:
+                return Image.fromFileSystem(str(path))
+        except Exception as e:
+            print(f"写入头像缓存异常: {traceback.format_exc()}")
+        return Image.fromBytes(image_data)
+
+    async def _fetch_avatar(self, user_id: str, avatar_size: int) -> Optional[bytes]:
+        avatar_api = self.config.get("avatar_api_url") or "http://q.qlogo.cn/headimg_dl"
+        avatar_url = f"{avatar_api}?dst_uin={user_id}&spec={avatar_size}"
+        try:
+            async with self._get_http_session().get(avatar_url, timeout=10) as resp:
+                # 检查响应状态码和 Content-Type，确保是图片
+                if resp.status == 200 and 'image' in resp.headers.get('Content-Type', ''):
+                    return await resp.read()
+                print(f"下载头像失败或获取到非图片内容，状态码: {resp.status}, Content-Type: {resp.headers.get('Content-Type')}")
+        except aiohttp.ClientError as e:
+            print(f"下载头像网络错误: {e}")
+        except asyncio.TimeoutError:
+            print("下载头像超时")
+        except Exception as e:
+            print(f"处理下载头像异常: {traceback.format_exc()}")
+        return None
+
+    async def _avatar_cache_sweep_task(self):
+        """启动时及之后每隔一段时间清理过期的磁盘头像缓存，避免缓存目录无限增长"""
+        while True:
+            try:
+                removed = await asyncio.to_thread(self._avatar_cache.prune_disk)
+                if removed:
+                    print(f"🧹 已清理 {removed} 个过期头像缓存文件")
+            except Exception as e:
+                print(f"清理头像缓存异常: {traceback.format_exc()}")
+            await asyncio.sleep(AVATAR_SWEEP_INTERVAL)
+
+    def _napcat_candidates(self) -> List[str]:
+        """本次请求依次尝试的Napcat主机，同时为到期的熔断主机安排后台探测"""
+        for host in self._host_manager.due_probes():
+            asyncio.create_task(self._probe_napcat_host(host))
+        return self._host_manager.candidates()
+
+    async def _napcat_call(self, host: str, action: str, payload: dict) -> dict:
+        """请求指定Napcat主机的接口，并记录该主机的延迟与成败
+
+        只有连接错误、超时与 5xx 计入熔断；4xx、非 JSON 响应等说明主机可达，只记为 bad_response 后抛出，
+        接口返回的业务失败（如机器人不在群内）原样交给调用方
+        """
+        start = time.monotonic()
+        try:
+            async with self._get_http_session().post(
+                f"http://{host}/{action}",
+                json=payload,
+                timeout=self.timeout
+            ) as resp:
+                if resp.status >= 500:
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status, message=resp.reason or ""
+                    )
+                data = await resp.json()
+                status = resp.status
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            self._host_manager.record_failure(host)
+            self._metrics.incr("napcat_requests_total", host=host, action=action, result="error")
+            raise
+        except aiohttp.ClientResponseError as e:
+            if e.status >= 500:
+                self._host_manager.record_failure(host)
+                self._metrics.incr("napcat_requests_total", host=host, action=action, result="error")
+            else:
+                self._metrics.incr("napcat_requests_total", host=host, action=action, result="bad_response")
+            raise
+        except Exception:
+            self._metrics.incr("napcat_requests_total", host=host, action=action, result="bad_response")
+            raise
+        elapsed = time.monotonic() - start
+        self._metrics.observe("napcat_seconds", elapsed, action=action)
+        if not 200 <= status < 300:
+            # 带 JSON 正文的 4xx 等非 2xx 响应既不计入熔断，也不作为延迟样本
+            self._metrics.incr("napcat_requests_total", host=host, action=action, result="bad_response")
+            return data
+        self._host_manager.record_success(host, elapsed, action)
+        result = "failed" if isinstance(data, dict) and data.get("status") == "failed" else "ok"
+        self._metrics.incr("napcat_requests_total", host=host, action=action, result=result)
+        return data
+
+    async def _probe_napcat_host(self, host: str):
+        """半开探测与预热：用轻量的 get_status 接口检查熔断主机是否恢复，或为新主机取得首个延迟样本"""
+        try:
+            await self._napcat_call(host, "get_status", {})
+        except Exception as e:
+            print(f"Napcat主机 {host} 探测失败: {e}")
+        finally:
+            self._host_manager.probe_finished(host)
+
+    @filter.command("全群配对")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @instrumented("bulk_pair")
+    async def bulk_pair_command(self, event: AstrMessageEvent):
+        group_id = str(event.message_obj.group_id)
+        parts = event.message_str.split()
+        if len(parts) >= 2:
+            if not parts[1].isdigit():
+                yield event.plain_result("❌ 参数错误\n格式：全群配对 [页码]")
+                return
+            yield event.plain_result(self._bulk_pair_page(group_id, int(parts[1])))
+            return
+        members = await self._get_members(group_id)
+        if not members:
+            yield event.plain_result("⚠️ 当前群组状态异常，请联系管理员")
+            return
+        bot_id = str(event.get_self_id())
+        async with self._group_locks.hold(group_id):
+            await self._check_reset(group_id)
+            group_data = self.pair_data[group_id]
+            members_by_id = {m.user_id: m for m in members}
+            # 与抽取相同的约束：跳过已配对、今日已被抽过、被屏蔽的成员和机器人自身，冷静期内的两人不配对
+            candidates = [uid for uid in members_by_id
+                          if uid != bot_id and uid not in self.blocked_users
+                          and not group_data.is_paired(uid) and not group_data.is_used(uid)]
+            pairs = self._matcher.match_all(candidates, self._cooling_index.contains)
+            paired_ids = []
+            lines = []
+            for uid, tid in pairs:
+                user, target = members_by_id[uid], members_by_id[tid]
+                group_data.pair(uid, user.card or user.nickname, tid, target.card or target.nickname)
+                paired_ids += (uid, tid)
+                lines.append(f"{self._format_member(user.card or user.nickname, uid)} 💕 "
+                             f"{self._format_member(target.card or target.nickname, tid)}")
+            if pairs:
+                # 整批配对合并为一条日志记录，一次落盘
+                self._record_pair_change(group_id, paired_ids)
+                self._matcher.mark_paired(group_id, paired_ids)
+        if not pairs:
+            yield event.plain_result("😢 没有可以配对的成员")
+            return
+        self._bulk_pair_results[group_id] = (self._today, lines)
+        unmatched = len(candidates) - len(paired_ids)
+        yield event.plain_result(
+            f"✅ 全群配对完成：新增 {len(pairs)} 对，{unmatched} 人因冷静期等限制未能配对\n"
+            + self._bulk_pair_page(group_id, 1))
+
+    def _bulk_pair_page(self, group_id: str, page: int) -> str:
+        """全群配对结果的指定页"""
+        date, lines = self._bulk_pair_results.get(group_id, (None, []))
+        if date != self._today or not lines:
+            return "📭 今日本群还没有全群配对记录"
+        pages = (len(lines) + BULK_PAIR_PAGE_SIZE - 1) // BULK_PAIR_PAGE_SIZE
+        if not 1 <= page <= pages:
+            return f"❌ 页码超出范围（共 {pages} 页）"
+        start = (page - 1) * BULK_PAIR_PAGE_SIZE
+        body = "\n".join(f"{start + i + 1}. {line}"
+                         for i, line in enumerate(lines[start:start + BULK_PAIR_PAGE_SIZE]))
+        footer = f"\n—— 第 {page}/{pages} 页"
+        if page < pages:
+            footer += f"，发送 全群配对 {page + 1} 查看下一页"
+        return f"【全群配对结果】\n{body}{footer}"
+
+    @filter.command("Napcat状态")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def napcat_status_command(self, event: AstrMessageEvent):
+        state_names = {"closed": "✅ 正常", "open": "⛔ 熔断", "half_open": "🔄 探测中"}
+        lines = ["【Napcat主机状态】"]
+        for info in self._host_manager.snapshot():
+            latency = f"{info['latency_ms']:.0f}ms" if info["latency_ms"] is not None else "未知"
+            line = (f"{info['host']}：{state_names[info['state']]}\n"
+                    f"▸ 成功 {info['successes']} 次 / 失败 {info['failures']} 次，平均延迟 {latency}")
+            if info["state"] != "closed":
+                line += f"\n▸ 连续失败 {info['consecutive_failures']} 次，{info['retry_in']:.0f} 秒后重新探测"
+            lines.append(line)
+        yield event.plain_result("\n".join(lines))
+
+    @filter.command("老婆插件统计")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def metrics_command(self, event: AstrMessageEvent):
+        fmt_ms = lambda seconds: f"{seconds * 1000:.0f}ms" if seconds is not None else ">10s"
+        lines = ["【插件运行统计】"]
+        stages = self._metrics.histograms("stage_seconds")
+        for labels, (count, avg, p50, p99) in sorted(self._metrics.histograms("command_seconds").items()):
+            command = dict(labels)["command"]
+            lines.append(f"{command}：{count} 次，平均 {fmt_ms(avg)}，p50 {fmt_ms(p50)}，p99 {fmt_ms(p99)}")
+            for stage_labels, (_, s_avg, _, s_p99) in sorted(stages.items()):
+                stage = dict(stage_labels)
+                if stage["command"] == command:
+                    lines.append(f"▸ {stage['stage']}：平均 {fmt_ms(s_avg)}，p99 {fmt_ms(s_p99)}")
+        persist_errors = self._metrics.counters("persist_errors_total")
+        for labels, (count, avg, p50, p99) in sorted(self._metrics.histograms("persist_seconds").items()):
+            line = f"落盘 {dict(labels)['store']}：{count} 次，平均 {fmt_ms(avg)}，p99 {fmt_ms(p99)}"
+            failed = persist_errors.get(labels, 0)
+            if failed:
+                line += f"，失败 {failed:.0f} 次"
+            lines.append(line)
+        napcat: Dict[str, Dict[str, float]] = {}
+        for labels, value in self._metrics.counters("napcat_requests_total").items():
+            info = dict(labels)
+            results = napcat.setdefault(info["host"], {})
+            results[info["result"]] = results.get(info["result"], 0) + value
+        for host, results in sorted(napcat.items()):
+            lines.append(f"Napcat {host}：请求 {sum(results.values()):.0f} 次，错误 {results.get('error', 0):.0f} 次，"
+                         f"响应异常 {results.get('bad_response', 0):.0f} 次，接口失败 {results.get('failed', 0):.0f} 次")
+        caches: Dict[str, Dict[str, float]] = {}
+        for labels, value in self._metrics.counters("cache_requests_total").items():
+            info = dict(labels)
+            caches.setdefault(info["cache"], {})[info["result"]] = value
+        for cache, results in sorted(caches.items()):
+            total = sum(results.values())
+            hit_rate = (total - results.get("miss", 0)) / total * 100 if total else 0
+            lines.append(f"{cache} 缓存：{total:.0f} 次，命中率 {hit_rate:.1f}%")
+        fetches = { dict(labels)["result"]: value for labels, value in self._metrics.counters("member_list_requests_total").items() }
+        if fetches:
+            lines.append(f"成员列表请求：实际发起 {fetches.get('fetched', 0):.0f} 次，合并 {fetches.get('deduplicated', 0):.0f} 次")
+        if len(lines) == 1:
+            lines.append("暂无数据")
+        yield event.plain_result("\n".join(lines))
+
+    def _on_persist_write(self, store: str, seconds: float, ok: bool):
+        self._metrics.observe("persist_seconds", seconds, store=store)
+        if not ok:
+            self._metrics.incr("persist_errors_total", store=store)
+
+    async def _metrics_dump_task(self):
+        """定期把指标以 Prometheus 文本格式写入磁盘，可供 node_exporter 的 textfile 收集器读取"""
+        path = Path(self.config["metrics_prometheus_path"])
+        interval = self.config.get("metrics_dump_interval", 60)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                text = self._metrics.render_prometheus()
+                await asyncio.to_thread(self._write_metrics_file, path, text)
+            except Exception as e:
+                print(f"写入指标文件失败: {traceback.format_exc()}")
+
+    @staticmethod
+    def _write_metrics_file(path: Path, text: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        temp_path.replace(path)
+
+    async def _get_group_member_info(self, group_id: str, user_id: str, label: str) -> Tuple[Optional[dict], Optional[str]]:
+        """查询群成员信息，返回 (成员信息, 最后错误)；开启对冲请求时并行向多个主机查询"""
+        payload = {
+            "group_id": group_id,
+            "user_id": user_id,
+            "no_cache": False
+        }
+        hosts = self._napcat_candidates()
+        if self.config.get("napcat_hedge_enabled", False) and len(hosts) > 1:
+            return await self._hedged_member_info(hosts, payload, label)
+        last_error = None
+        for host in hosts:
+            member_info, error = await self._try_member_info(host, payload, label)
+            if member_info is not None:
+                return member_info, None
+            last_error = error
+        return None, last_error
+
+    async def _hedged_member_info(self, hosts: List[str], payload: dict, label: str) -> Tuple[Optional[dict], Optional[str]]:
+        """对冲请求：首个主机超过对冲延迟仍未返回时向下一个主机并行发起，取最先成功的结果并取消其余请求"""
+        delay = self._hedge_delay()
+        pending: Set[asyncio.Task] = set()
+        # 任务 -> (主机, 发起时间)，用于给落败的请求记录延迟下限
+        started: Dict[asyncio.Task, Tuple[str, float]] = {}
+        next_index = 0
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            host = hosts[next_index]
+            task = asyncio.create_task(self._try_member_info(host, payload, label))
+            pending.add(task)
+            started[task] = (host, time.monotonic())
+            next_index += 1
+
+        launch()
+        try:
+            while pending:
+                timeout = delay if next_index < len(hosts) else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    member_info, error = task.result()
+                    if member_info is not None:
+                        return member_info, None
+                    last_error = error
+                # 已有主机明确失败，不必等待对冲延迟
+                if next_index < len(hosts):
+                    launch()
+            return None, last_error
+        finally:
+            now = time.monotonic()
+            for task in pending:
+                task.cancel()
+                # 慢主机总是落败时也要让它的延迟估计变大，否则会一直排在候选主机最前
+                host, start = started[task]
+                self._host_manager.record_lower_bound(host, now - start)
+
+    def _hedge_delay(self) -> float:
+        """对冲延迟：优先使用配置值，否则取近期 get_group_member_info 成功请求延迟的 p95"""
+        delay_ms = self.config.get("napcat_hedge_delay_ms", 0)
+        if delay_ms > 0:
+            return delay_ms / 1000
+        p95 = self._host_manager.latency_percentile(0.95, "get_group_member_info")
+        return p95 if p95 is not None else min(self.timeout, 1.0)
+
+    async def _try_member_info(self, host: str, payload: dict, label: str) -> Tuple[Optional[dict], Optional[str]]:
+        try:
+            print(f"🔍 {label}功能使用主机: {host}")
+            response_data = await self._napcat_call(host, "get_group_member_info", payload)
+            if response_data.get("status") == "failed" and "不存在" in response_data.get("message", ""):
+                print(f"❌ {host} 报告用户不存在，尝试下一个主机")
+                return None, f"{host}: {response_data.get('message')}"
+            elif response_data.get("status") == "ok" and "data" in response_data:
+                return response_data["data"], None
+            else:
+                print(f"Napcat API 错误 ({label}): {response_data}")
+                return None, f"{host}: {response_data}"
+        except aiohttp.ClientError as e:
+            print(f"连接 Napcat API 失败 ({label}): {e}")
+            return None, f"{host}: {str(e)}"
+        except asyncio.TimeoutError:
+            print(f"连接 Napcat API 超时 ({label})")
+            return None, f"{host}: 超时"
+        except Exception as e:
+            print(f"{label}异常: {traceback.format_exc()}")
+            return None, f"{host}: {str(e)}"
+
     # --------------- 核心功能 ---------------
     async def _get_members(self, group_id: str) -> Optional[List]:
+        """优先使用成员缓存；缓存过期但仍在陈旧期内时先返回旧数据，并在后台刷新"""
+        key = str(group_id)
+        ttl = self.config.get("member_cache_ttl", 300)
+        stale_ttl = self.config.get("member_cache_stale_ttl", 1800)
+        members, age = self._member_cache.get(key)
+        warm = False
+        if members is None and ttl > 0:
+            # 冷启动预热：从快照载入，快照期间可能漏收群通知，过期时照常后台刷新
+            members, age = await self._load_member_snapshot(key)
+            warm = members is not None
+        if members is not None:
+            if age <= ttl or (self._member_index_enabled and not warm):
+                self._metrics.incr("cache_requests_total", cache="member", result="hit")
+                return members
+            if age <= ttl + stale_ttl or warm:
+                self._metrics.incr("cache_requests_total", cache="member", result="snapshot" if warm else "stale")
+                if key not in self._member_refreshing:
+                    self._member_refreshing.add(key)
+                    asyncio.create_task(self._refresh_members(key))
+                return members
+        self._metrics.incr("cache_requests_total", cache="member", result="miss")
+        return await self._load_members_shared(key)
+
+    async def _load_members_shared(self, group_id: str) -> Optional[List]:
+        """同一群并发的成员列表请求只发起一次，结果与异常由所有调用者共享"""
+        deduplicated = self._member_flight.pending(group_id)
+        self._metrics.incr("member_list_requests_total", result="deduplicated" if deduplicated else "fetched")
+        return await self._member_flight.do(group_id, lambda: self._load_members(group_id))
+
+    async def _load_members(self, group_id: str) -> Optional[List]:
+        members = await self._fetch_members(int(group_id))
+        if not members:
+            # 所有Napcat主机都不可用时，退回到有效期内的成员快照
+            members, age = await self._load_member_snapshot(group_id)
+            if members:
+                print(f"⚠️ 群 {group_id} 使用 {age / 60:.0f} 分钟前的成员快照")
+                self._metrics.incr("cache_requests_total", cache="member", result="fallback")
+            return members
+        if self.config.get("member_cache_ttl", 300) > 0:
+            self._member_cache.put(group_id, members)
+        if self._member_snapshot_max_age > 0:
+            asyncio.create_task(self._save_member_snapshot(group_id, list(members)))
+        return members
+
+    async def _load_member_snapshot(self, group_id: str) -> Tuple[Optional[List], float]:
+        """读取有效期内的成员快照，返回 (成员列表, 快照已有秒数)；成功时同时写入成员缓存"""
+        age = self._member_snapshots.age(group_id)
+        if age is None or age > self._member_snapshot_max_age:
+            return None, 0
+        members = await asyncio.to_thread(self._member_snapshots.load, group_id)
+        if not members:
+            self._member_snapshots.forget(group_id)
+            return None, 0
+        if self.config.get("member_cache_ttl", 300) > 0 and group_id not in self._member_cache:
+            self._member_cache.put(group_id, members, age)
+        return members, age
+
+    async def _save_member_snapshot(self, group_id: str, members: List[GroupMember]):
+        try:
+            await asyncio.to_thread(self._member_snapshots.save, group_id, members)
+        except Exception as e:
+            print(f"保存群成员快照失败: {traceback.format_exc()}")
+
+    async def _refresh_members(self, group_id: str):
+        try:
+            await self._load_members_shared(group_id)
+        except Exception as e:
+            print(f"后台刷新群成员失败: {traceback.format_exc()}")
+        finally:
+            self._member_refreshing.discard(group_id)
+
+    async def _member_resync_task(self):
+        """成员索引的低优先级全量校准：逐群串行刷新并在群之间留出间隔，避免与抽取争抢Napcat"""
+        interval = self.config.get("member_resync_interval", 3600)
+        while True:
+            await asyncio.sleep(max(interval / 4, 30))
+            for group_id in self._member_cache.groups_older_than(interval):
+                if group_id not in self._member_cache or group_id in self._member_refreshing:
+                    continue
+                self._member_refreshing.add(group_id)
+                await self._refresh_members(group_id)
+                self._metrics.incr("member_resyncs_total")
+                await asyncio.sleep(MEMBER_RESYNC_SPACING)
+
+    @event_message_type(EventMessageType.GROUP_MESSAGE)
+    async def member_notice_handler(self, event: AstrMessageEvent):
+        """群成员增减与群名片变更通知：原地修补已缓存的成员索引"""
+        # 协议端的通知同样作为群事件分发，普通消息在这里直接返回
+        raw = event.message_obj.raw_message
+        if not isinstance(raw, dict) or raw.get("post_type") != "notice":
+            return
+        notice_type = raw.get("notice_type")
+        if notice_type not in MEMBER_NOTICE_TYPES or not self._member_index_enabled:
+            return
+        group_id = str(raw.get("group_id"))
+        user_id = str(raw.get("user_id"))
+        if group_id not in self._member_cache:
+            return
+        self._metrics.incr("member_notices_total", type=notice_type)
+        try:
+            if notice_type == "group_card":
+                self._member_cache.update_card(group_id, user_id, raw.get("card_new") or "")
+            elif notice_type == "group_decrease":
+                if user_id == str(event.get_self_id()):
+                    # 机器人自身退群或被踢，整群索引作废
+                    self._member_cache.invalidate(group_id)
+                    self._member_snapshots.forget(group_id)
+                    self._matcher.invalidate(group_id)
+                elif self._member_cache.remove_member(group_id, user_id):
+                    self._matcher.remove_member(group_id, user_id)
+            else:
+                info, _ = await self._get_group_member_info(group_id, user_id, "成员变动")
+                info = info or {}
+                member = GroupMember({
+                    "user_id": user_id,
+                    "nickname": info.get("nickname") or user_id,
+                    "card": info.get("card") or "",
+                })
+                if self._member_cache.add_member(group_id, member):
+                    self._matcher.add_member(group_id, member)
+        except Exception as e:
+            print(f"处理群成员变动通知失败: {traceback.format_exc()}")
+
+    async def _fetch_members(self, group_id: str) -> Optional[List]:
     # 简化版本 - 只尝试所有主机一次
-        for host in self.napcat_hosts:
+        for host in self._napcat_candidates():
             try:
                 print(f"🔍 尝试从 {host} 获取群成员...")
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"http://{host}/get_group_member_list",
-                        json={"group_id": group_id},
-                        timeout=self.timeout
-                    ) as resp:
-                        data = await resp.json()
-                        if "data" in data and isinstance(data["data"], list):
-                            members = [GroupMember(m) for m in data["data"] if "user_id" in m]
-                            if len(members) > 0:
-                                print(f"✅ {host} 成功获取 {len(members)} 个成员")
-                                return members
-                            else:
-                                print(f"⚠️ {host} 返回0个成员")
-                        else:
-                            print(f"❌ {host} 返回数据结构异常")
+                data = await self._napcat_call(host, "get_group_member_list", {"group_id": group_id})
+                if "data" in data and isinstance(data["data"], list):
+                    members = [GroupMember(m) for m in data["data"] if "user_id" in m]
+                    if len(members) > 0:
+                        print(f"✅ {host} 成功获取 {len(members)} 个成员")
+                        return members
+                    else:
+                        print(f"⚠️ {host} 返回0个成员")
+                else:
+                    print(f"❌ {host} 返回数据结构异常")
             except Exception as e:
                 print(f"❌ 连接 {host} 失败: {e}")
     
         print("💥 所有主机连接失败")
         return None
 
-    def _check_reset(self, group_id: str):
+    async def _check_reset(self, group_id: str):
+        """每条命令只比较一次时间戳，跨天的批量重置由 _daily_rollover 完成"""
+        if time.time() >= self._next_rollover_ts:
+            # 定时任务还没来得及执行时由首条命令补做
+            self._daily_rollover()
+        if self._shards is not None:
+            self._group_access[group_id] = time.monotonic()
+            if group_id not in self.pair_data:
+                await self._load_group_shard_shared(group_id)
+        if group_id not in self.pair_data:
+            # 空群记录与不存在等价，无需落盘
+            self.pair_data[group_id] = GroupPairs(self._today)
+
+    async def _load_group_shard_shared(self, group_id: str):
+        """同一群并发的分片载入只读取一次文件"""
+        await self._shard_flight.do(group_id, lambda: self._load_group_shard(group_id))
+
+    async def _load_group_shard(self, group_id: str):
+        """首次使用时从分片载入群的配对数据与进阶功能使用次数，文件在线程中读取"""
+        # 读取期间后台写入器可能已按重置改写分片并撤销标记，此时沿用读取前的标记（重复清空无副作用）
+        reset_before = self._pending_resets.get(group_id)
+        shard = await asyncio.to_thread(self._shards.load, group_id)
+        if group_id in self.pair_data:
+            return
+        reset = self._pending_resets.pop(group_id, reset_before)
+        if reset is not None:
+            # 重置后分片尚未改写：按重置后的内容载入，并由后台写入器重写
+            self._mark_group_dirty(group_id)
+            if shard is None or not reset:
+                return
+            shard["pairs"], shard["used"] = {}, []
+        if shard is None:
+            return
+        if shard.get("date") != self._today:
+            # 跨天前的分片已失效，交给后台写入器删除
+            self._mark_group_dirty(group_id)
+            return
+        usage = shard.pop("usage", {})
         try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            if group_id not in self.pair_data or self.pair_data[group_id].get("date") != today:
-                self.pair_data[group_id] = {"date": today, "pairs": {}, "used": []}
-                self._save_pair_data()
-        except Exception as e:
-            print(f"重置检查失败: {traceback.format_exc()}")
+            self._migrate_group_data(shard)
+            self.pair_data[group_id] = GroupPairs.from_json(shard)
+        except (KeyError, TypeError, ValueError):
+            print(f"⚠️ 跳过无法解析的群配对数据: {group_id}")
+            return
+        if self.advanced_usage.date == self._today:
+            self.advanced_usage.load_group(group_id, usage)
+        self._group_access[group_id] = time.monotonic()
+        self._metrics.incr("group_shard_loads_total")
+
+    async def _shard_evict_task(self):
+        """定期把长时间没有命令访问的群移出内存，下次使用时再从分片载入"""
+        idle = self.config.get("group_idle_evict_minutes", 30) * 60
+        while True:
+            await asyncio.sleep(max(idle / 4, 30))
+            self._evict_idle_groups(idle)
+
+    def _evict_idle_groups(self, idle: float) -> int:
+        now = time.monotonic()
+        evicted = 0
+        for group_id, last_access in list(self._group_access.items()):
+            # 尚未落盘、正在写入或正在处理命令的群留在内存中
+            if (now - last_access < idle or group_id in self._dirty_groups
+                    or group_id in self._writing_groups or group_id in self._group_locks):
+                continue
+            del self._group_access[group_id]
+            self.pair_data.pop(group_id, None)
+            self.advanced_usage.drop_group(group_id)
+            self._matcher.invalidate(group_id)
+            self._bulk_pair_results.pop(group_id, None)
+            evicted += 1
+        if evicted:
+            self._metrics.incr("group_shard_evictions_total", evicted)
+        return evicted
 
     def _is_advanced_enabled(self, group_id: str) -> bool:
         """
@@ -388,6 +2635,7 @@ class DailyWifePlugin(Star):
 
     # --------------- 用户功能 ---------------
     @filter.regex(r"^今日老婆$") # 或者 filter.command("今日老婆") 取决于你的选择
+    @instrumented("daily_wife")
     async def daily_wife_command(self, event: AstrMessageEvent):
         if not hasattr(event.message_obj, "group_id"):
             yield event.plain_result("此命令仅限群聊中使用。")
@@ -396,96 +2644,74 @@ class DailyWifePlugin(Star):
             group_id = str(event.message_obj.group_id)
             user_id = event.get_sender_id()
             bot_id = event.message_obj.self_id
-            self._check_reset(group_id)
-            group_data = self.pair_data.get(group_id, {"date": datetime.now().strftime("%Y-%m-%d"), "pairs": {}, "used": []})
+            await self._check_reset(group_id)
+            group_data = self.pair_data[group_id]
 
             # Check if the user is already in a pairing
-            if user_id in group_data.get("pairs", {}):
+            if group_data.is_paired(user_id):
                 try:
-                        group_id = str(event.message_obj.group_id)
-                        user_id = event.get_sender_id()
-                        self._check_reset(group_id)
-                        group_data = self.pair_data.get(group_id, {})
-                        partner_info = group_data["pairs"][user_id]
-                        formatted_info = self._format_display_info(partner_info['display_name'])
+                        partner_info = group_data.partner(user_id)
+                        formatted_info = self._format_member(partner_info.name, partner_info.partner)
 
                         message_elements = [Plain(f"💖 您的今日伴侣：{formatted_info}\n(请好好对待TA)")]
 
                         # 检查是否开启了显示头像
                         if self.config.get("show_avatar", True): # 从配置中获取 show_avatar 状态，默认为 True
-                            partner_id = partner_info['user_id']
-                            avatar_size = self.config.get("avatar_size", 100) # 从配置中获取头像尺寸，默认为 100
-                            avatar_url = f"http://q.qlogo.cn/headimg_dl?dst_uin={partner_id}&spec={avatar_size}"
-
-                            image_to_send = None
-                            try:
-                                async with aiohttp.ClientSession() as session:
-                                    async with session.get(avatar_url, timeout=10) as resp:
-                                        # 检查响应状态码和 Content-Type，确保是图片
-                                        if resp.status == 200 and 'image' in resp.headers.get('Content-Type', ''):
-                                            image_data = await resp.read()
-                                            # 使用图片数据创建 Image 消息段
-                                            # 这里的 Image.fromBytes 需要根据你的 Astral 库具体实现来调整
-                                            # 如果没有 fromBytes 方法，可能需要使用 Image(raw=image_data) 或其他方式
-                                            image_to_send = Image.fromBytes(image_data)
-                                        else:
-                                            print(f"下载头像失败或获取到非图片内容，状态码: {resp.status}, Content-Type: {resp.headers.get('Content-Type')}")
-                            except aiohttp.ClientError as e:
-                                print(f"下载头像网络错误: {e}")
-                            except asyncio.TimeoutError:
-                                print("下载头像超时")
-                            except Exception as e:
-                                print(f"处理下载头像异常: {traceback.format_exc()}")
+                            partner_id = str(partner_info.partner)
+                            with self._metrics.time("stage_seconds", command="daily_wife", stage="avatar"):
+                                image_to_send = await self._download_avatar(partner_id)
 
                             if image_to_send:
                                 message_elements.append(image_to_send)
                             else:
                                 message_elements.append(Plain("\n[头像获取失败]"))
 
-                        yield event.chain_result(message_elements)
+                        with self._metrics.time("stage_seconds", command="daily_wife", stage="reply"):
+                            yield event.chain_result(message_elements)
                         return
                 except Exception as e:
                     print(f"获取老婆发生异常: {traceback.format_exc()}")
                     yield event.plain_result("❌ 获取老婆发生异常")
 
-            members = await self._get_members(int(group_id))
+            with self._metrics.time("stage_seconds", command="daily_wife", stage="napcat_fetch"):
+                members = await self._get_members(int(group_id))
             if not members:
                 yield event.plain_result("⚠️ 当前群组状态异常，请联系管理员")
                 return
-            valid_members = [m for m in members if m.user_id not in {user_id, bot_id}
-                                            and m.user_id not in group_data["used"]
-                                            and not self._is_in_cooling_period(user_id, m.user_id)
-                                            and m.user_id not in group_data.get("pairs", {}) ] # 新增：确保被抽取的对象没有伴侣
-
             target = None
-            # 尝试选取一个未配对的成员
-            for _ in range(len(valid_members)): # 尝试次数等于剩余有效成员数
-                 if not valid_members:
-                     break
-                 chosen_member = random.choice(valid_members)
-                 if chosen_member.user_id not in group_data.get("pairs", {}):
-                     target = chosen_member
-                     break
-                 else:
-                     valid_members.remove(chosen_member)
-
-
+            select_start = time.perf_counter()
+            async with self._group_locks.hold(group_id):
+                # 获取成员期间同群的其他抽取可能已经完成，提交前重新校验
+                await self._check_reset(group_id)
+                group_data = self.pair_data[group_id]
+                already_paired = group_data.is_paired(user_id)
+                if not already_paired:
+                    cooling_partners = self._cooling_index.partners(user_id)
+                    bot_id = str(bot_id)
+                    # 已配对或今日已被抽过的成员（确保被抽取的对象没有伴侣）
+                    unavailable = lambda uid: group_data.is_paired(uid) or group_data.is_used(uid)
+                    excluded = lambda uid: (uid == user_id or uid == bot_id
+                                            or uid in cooling_partners or uid in self.blocked_users)
+                    members_by_id, pool = self._matcher.pool(group_id, group_data.date, members, unavailable)
+                    target_id = self._matcher.draw(pool, unavailable, excluded)
+                    target = members_by_id.get(target_id) if target_id else None
+
+                if target:
+                    # Create a bidirectional pairing
+                    group_data.pair(user_id, event.get_sender_name(), target.user_id, target.card or target.nickname)
+                    self._record_pair_change(group_id, [user_id, target.user_id])
+                    self._matcher.mark_paired(group_id, [user_id, target.user_id])
+            self._metrics.observe("stage_seconds", time.perf_counter() - select_start, command="daily_wife", stage="selection")
+
+            if already_paired:
+                yield event.plain_result("💖 你已经有伴侣了，发送 查询老婆 查看")
+                return
             if not target:
                 yield event.plain_result("😢 暂时找不到合适的人选")
                 return
 
-            # Create a bidirectional pairing
-            sender_display = self._format_display_info(f"{event.get_sender_name()}({user_id})")
-            group_data["pairs"][user_id] = {"user_id": target.user_id, "display_name": target.display_info}
-            group_data["pairs"][target.user_id] = {"user_id": user_id, "display_name": sender_display}
-            if user_id not in group_data["used"]:
-                group_data["used"].append(user_id)
-            if target.user_id not in group_data["used"]:
-                group_data["used"].append(target.user_id)
-            self._save_pair_data()
-
-            sender_display = self._format_display_info(f"{event.get_sender_name()}({user_id})")
-            target_display = self._format_display_info(target.display_info)
+            sender_display = self._format_member(event.get_sender_name(), user_id)
+            target_display = self._format_member(target.card or target.nickname, target.user_id)
 
             message_elements = [
                 Plain(f"恭喜{sender_display}，\n"),
@@ -494,24 +2720,9 @@ class DailyWifePlugin(Star):
 
             # 检查是否开启了显示头像
             if self.config.get("show_avatar", True): # 从配置中获取 show_avatar 状态，默认为 True
-                avatar_size = self.config.get("avatar_size", 100) # 从配置中获取头像尺寸，默认为 100
-                avatar_url = f"http://q.qlogo.cn/headimg_dl?dst_uin={target.user_id}&spec={avatar_size}"
                 message_elements.append(Plain("▻ 对方头像："))
-                image_to_send = None
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(avatar_url, timeout=10) as resp:
-                             if resp.status == 200 and 'image' in resp.headers.get('Content-Type', ''):
-                                image_data = await resp.read()
-                                image_to_send = Image.fromBytes(image_data) # 同样这里假设有 fromBytes 方法
-                             else:
-                                print(f"下载头像失败或获取到非图片内容，状态码: {resp.status}, Content-Type: {resp.headers.get('Content-Type')}")
-                except aiohttp.ClientError as e:
-                    print(f"下载头像网络错误: {e}")
-                except asyncio.TimeoutError:
-                    print("下载头像超时")
-                except Exception as e:
-                    print(f"处理下载头像异常: {traceback.format_exc()}")
+                with self._metrics.time("stage_seconds", command="daily_wife", stage="avatar"):
+                    image_to_send = await self._download_avatar(target.user_id)
 
                 if image_to_send:
                      message_elements.append(image_to_send)
@@ -524,7 +2735,8 @@ class DailyWifePlugin(Star):
                 Plain("使用 /查询老婆 查看详细信息")
             ])
 
-            yield event.chain_result(message_elements)
+            with self._metrics.time("stage_seconds", command="daily_wife", stage="reply"):
+                yield event.chain_result(message_elements)
 
         except Exception as e:
             print(f"配对异常: {traceback.format_exc()}")
@@ -532,97 +2744,76 @@ class DailyWifePlugin(Star):
 
 
     @filter.regex(r"^查询老婆$")
+    @instrumented("query")
     async def query_handler(self, event: AstrMessageEvent):
         try:
             group_id = str(event.message_obj.group_id)
             user_id = event.get_sender_id()
-            self._check_reset(group_id)
-            group_data = self.pair_data.get(group_id, {})
-            if user_id not in group_data.get("pairs", {}):
+            await self._check_reset(group_id)
+            partner_info = self.pair_data[group_id].partner(user_id)
+            if partner_info is None:
                 yield event.plain_result("🌸 你还没有伴侣哦~")
                 return
-            partner_info = group_data["pairs"][user_id]
-            formatted_info = self._format_display_info(partner_info['display_name'])
+            formatted_info = self._format_member(partner_info.name, partner_info.partner)
 
             message_elements = [Plain(f"💖 您的今日伴侣：{formatted_info}\n(请好好对待TA)")]
 
             # 检查是否开启了显示头像
             if self.config.get("show_avatar", True): # 从配置中获取 show_avatar 状态，默认为 True
-                partner_id = partner_info['user_id']
-                avatar_size = self.config.get("avatar_size", 100) # 从配置中获取头像尺寸，默认为 100
-                avatar_url = f"http://q.qlogo.cn/headimg_dl?dst_uin={partner_id}&spec={avatar_size}"
-
-                image_to_send = None
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(avatar_url, timeout=10) as resp:
-                            # 检查响应状态码和 Content-Type，确保是图片
-                            if resp.status == 200 and 'image' in resp.headers.get('Content-Type', ''):
-                                image_data = await resp.read()
-                                # 使用图片数据创建 Image 消息段
-                                # 这里的 Image.fromBytes 需要根据你的 Astral 库具体实现来调整
-                                # 如果没有 fromBytes 方法，可能需要使用 Image(raw=image_data) 或其他方式
-                                image_to_send = Image.fromBytes(image_data)
-                            else:
-                                print(f"下载头像失败或获取到非图片内容，状态码: {resp.status}, Content-Type: {resp.headers.get('Content-Type')}")
-                except aiohttp.ClientError as e:
-                    print(f"下载头像网络错误: {e}")
-                except asyncio.TimeoutError:
-                    print("下载头像超时")
-                except Exception as e:
-                    print(f"处理下载头像异常: {traceback.format_exc()}")
+                partner_id = str(partner_info.partner)
+                with self._metrics.time("stage_seconds", command="query", stage="avatar"):
+                    image_to_send = await self._download_avatar(partner_id)
 
                 if image_to_send:
                      message_elements.append(image_to_send)
                 else:
                      message_elements.append(Plain("\n[头像获取失败]"))
 
-            yield event.chain_result(message_elements)
+            with self._metrics.time("stage_seconds", command="query", stage="reply"):
+                yield event.chain_result(message_elements)
 
         except Exception as e:
             print(f"查询异常: {traceback.format_exc()}")
             yield event.plain_result("❌ 查询过程发生异常")
 
     @filter.regex(r"^我要分手$")
+    @instrumented("divorce")
     async def divorce_command(self, event: AstrMessageEvent):
         try:
             group_id = str(event.message_obj.group_id)
             user_id = event.get_sender_id()
-            if group_id not in self.pair_data or user_id not in self.pair_data[group_id]["pairs"]:
+            await self._check_reset(group_id)
+            group_data = self.pair_data[group_id]
+            partner_info = group_data.partner(user_id)
+            if partner_info is None:
                 yield event.plain_result("🌸 您还没有伴侣哦~")
                 return
-            partner_info = self.pair_data[group_id]["pairs"][user_id]
-            partner_id = partner_info["user_id"]
-            today = datetime.now().strftime("%Y-%m-%d")
-            user_counts = self.breakup_counts.get(today, {})
-            current_count = user_counts.get(user_id, 0)
+            partner_id = str(partner_info.partner)
+            current_count = self.breakup_counts.count(group_id, user_id)
             if current_count >= self.config["max_daily_breakups"]:
                 block_hours = self.config["breakup_block_hours"]
-                expire_time = datetime.now() + timedelta(hours=block_hours)
-                self.blocked_users.add(user_id)
-                self.cooling_data[f"block_{user_id}"] = {"users": [user_id], "expire_time": expire_time}
-                self._save_blocked_users()
-                self._save_cooling_data()
-                yield event.chain_result([Plain(f"⚠️ 检测到异常操作：\n▸ 今日已分手 {current_count} 次\n▸ 功能已临时禁用 {block_hours} 小时")])
+                expire_time = self._now() + timedelta(hours=block_hours)
+                # block_ 记录标记自动屏蔽，到期时随记录解除；管理员手动屏蔽的用户不加记录，避免到期后被误解除
+                if user_id not in self.blocked_users or f"block_{user_id}" in self.cooling_data:
+                    self.blocked_users.add(user_id)
+                    self.cooling_data[f"block_{user_id}"] = {"users": [user_id], "expire_time": expire_time}
+                    self._save_blocked_users()
+                    self._save_cooling_data()
+                yield event.chain_result([Plain(f"⚠️ 检测到异常操作：\n▸ {self._breakup_window_label()}已分手 {current_count} 次\n▸ 功能已临时禁用 {block_hours} 小时")])
                 return
 
             # 删除双方的配对记录
-            if user_id in self.pair_data[group_id]["pairs"]:
-                del self.pair_data[group_id]["pairs"][user_id]
-            if partner_id in self.pair_data[group_id]["pairs"] and self.pair_data[group_id]["pairs"][partner_id]["user_id"] == user_id:
-                del self.pair_data[group_id]["pairs"][partner_id]
-
-            group_data = self.pair_data[group_id]
-            group_data["used"] = [uid for uid in group_data["used"] if uid != user_id and uid != partner_id]
-            self._save_pair_data()
+            group_data.unpair(user_id)
+            group_data.release(user_id, partner_id)
+            self._record_pair_change(group_id, [user_id, partner_id])
+            self._matcher.release(group_id, [user_id, partner_id])
             cooling_key = f"{user_id}-{partner_id}"
             cooling_hours = self.config.get("default_cooling_hours", 48)
-            self.cooling_data[cooling_key] = {"users": [user_id, partner_id], "expire_time": datetime.now() + timedelta(hours=cooling_hours)}
+            self._add_cooling_record(cooling_key, [user_id, partner_id], self._now() + timedelta(hours=cooling_hours))
             self._save_cooling_data()
             yield event.chain_result([Plain(f"💔 您已解除与伴侣的关系\n⏳ {cooling_hours}小时内无法再匹配到一起")])
-            user_counts[user_id] = current_count + 1
-            self.breakup_counts[today] = user_counts
-            self._save_data(BREAKUP_COUNT_PATH, self.breakup_counts)
+            self.breakup_counts.incr(self._today, group_id, user_id)
+            self._save_breakup_counts()
         except Exception as e:
             print(f"分手异常: {traceback.format_exc()}")
             yield event.plain_result("❌ 分手操作异常")
@@ -636,18 +2827,28 @@ class DailyWifePlugin(Star):
         if self.advanced_enabled.get(group_id, False):
             yield event.plain_result("进阶功能已开启。")
             return
-        # 记录用户ID和会话信息
-        DailyWifePlugin.ADVANCED_ENABLE_STATES[user_id] = {"session": event.session, "timestamp": time.time()}
-        yield event.plain_result("请在30秒内发送确认命令：我已知晓进阶功能带来的潜在风险并且执意开启")
+        # 记录群号、用户ID和会话信息，每个待确认请求各自定时，超时后自动移除
+        key = (group_id, user_id)
+        self._cancel_advanced_enable(key)
+        timer = asyncio.get_running_loop().call_later(
+            self.ADVANCED_CONFIRM_TIMEOUT, self._on_advanced_enable_timeout, key)
+        DailyWifePlugin.ADVANCED_ENABLE_STATES[key] = {"session": event.session, "timestamp": time.time(), "timer": timer}
+        DailyWifePlugin.ADVANCED_PENDING_GROUPS[group_id] = DailyWifePlugin.ADVANCED_PENDING_GROUPS.get(group_id, 0) + 1
+        yield event.plain_result(f"请在{self.ADVANCED_CONFIRM_TIMEOUT}秒内发送确认命令：我已知晓进阶功能带来的潜在风险并且执意开启")
 
     @event_message_type(EventMessageType.GROUP_MESSAGE)
     async def confirm_enable_advanced(self, event: AstrMessageEvent):
-        user_id = event.get_sender_id()
+        # 每条群消息都会经过这里，没有待确认请求时直接返回
+        if not DailyWifePlugin.ADVANCED_ENABLE_STATES:
+            return
         group_id = str(event.message_obj.group_id)
-        if user_id in DailyWifePlugin.ADVANCED_ENABLE_STATES and event.message_str.strip() == "我已知晓进阶功能带来的潜在风险并且执意开启":
-            del DailyWifePlugin.ADVANCED_ENABLE_STATES[user_id]
+        if group_id not in DailyWifePlugin.ADVANCED_PENDING_GROUPS:
+            return
+        key = (group_id, event.get_sender_id())
+        if key in DailyWifePlugin.ADVANCED_ENABLE_STATES and event.message_str.strip() == "我已知晓进阶功能带来的潜在风险并且执意开启":
+            self._cancel_advanced_enable(key)
             self.advanced_enabled[group_id] = True
-            self._save_data(ADVANCED_ENABLED_PATH, self.advanced_enabled)
+            self._save_advanced_enabled()
             yield event.plain_result("进阶功能已开启，该群现已启用进阶功能。")
 
     @filter.command("关闭进阶老婆插件功能")
@@ -655,16 +2856,11 @@ class DailyWifePlugin(Star):
     async def disable_advanced_command(self, event: AstrMessageEvent):
         group_id = str(event.message_obj.group_id)
         self.advanced_enabled[group_id] = False
-        self._save_data(ADVANCED_ENABLED_PATH, self.advanced_enabled)
+        self._save_advanced_enabled()
         yield event.plain_result("进阶功能已关闭，该群已禁用进阶功能。")
 
-    def _init_advanced_usage(self, group_id: str, user_id: str):
-        if group_id not in self.advanced_usage:
-            self.advanced_usage[group_id] = {}
-        if user_id not in self.advanced_usage[group_id]:
-            self.advanced_usage[group_id][user_id] = {"wish": 0, "rob": 0, "lock": 0}
-
     @filter.command("许愿")
+    @instrumented("wish")
     async def wish_command(self, event: AiocqhttpMessageEvent, input_id: int | None = None):
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
@@ -686,121 +2882,81 @@ class DailyWifePlugin(Star):
         if target_qq is None:
             target_qq = str(input_id)
 
+        if not target_qq.isdigit():
+            yield event.plain_result("❌ 参数错误：请@或直接跟QQ号指定许愿对象。")
+            return
+
         if user_id == target_qq:
             yield event.plain_result("❌ 无法对自己使用许愿功能。")
             return
 
-        self._init_advanced_usage(group_id, user_id)
-        if self.advanced_usage[group_id][user_id]["wish"] >= self.config.get("max_daily_wishes", 1):
+        await self._check_reset(group_id)
+        if self.advanced_usage.get(group_id, user_id, "wish") >= self.config.get("max_daily_wishes", 1):
             yield event.plain_result("❌ 今日许愿次数已用完。")
             return
 
-        if group_id not in self.pair_data:
-            self.pair_data[group_id] = {"date": datetime.now().strftime("%Y-%m-%d"), "pairs": {}, "used": []}
         group_data = self.pair_data[group_id]
 
-        if user_id in group_data["pairs"]:
+        if group_data.is_paired(user_id):
             yield event.plain_result("❌ 你已经有伴侣了……许愿将不可用")
             return
 
     # 新增的判断：检查目标是否已经配对
-        if target_qq in group_data["pairs"]:
-            target_info = group_data["pairs"].get(target_qq)
-            target_display_name = target_info.get("display_name", f"QQ号为 {target_qq} 的用户") if target_info else f"QQ号为 {target_qq} 的用户"
+        if group_data.is_paired(target_qq):
             yield event.plain_result(f"❌ 你许愿的对象已经有伴侣了哦，请改用强娶功能")
             return
 
-    # 多端口尝试
-        last_error = None
-        for attempt in range(len(self.napcat_hosts)):
-            current_host = self._get_current_napcat_host()
-            try:
-                print(f"🔍 许愿功能使用主机: {current_host}")
-            
-                payload = {
-                    "group_id": group_id,
-                    "user_id": target_qq,
-                    "no_cache": False
-                }
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"http://{current_host}/get_group_member_info",
-                        json=payload, 
-                        timeout=self.timeout
-                    ) as resp:
-                        response_data = await resp.json()
-                    
-                        if response_data.get("status") == "failed" and "不存在" in response_data.get("message", ""):
-                            print(f"❌ {current_host} 报告用户不存在，尝试下一个主机")
-                            last_error = f"{current_host}: {response_data.get('message')}"
-                            continue
-                    
-                        elif response_data.get("status") == "ok" and "data" in response_data:
-                            target_nickname = response_data["data"].get("nickname", f"未知用户({target_qq})")
-                            sender_nickname = event.get_sender_name()
-                            group_data["pairs"][user_id] = {"user_id": target_qq, "display_name": f"{target_nickname}({target_qq})"}
-                            group_data["pairs"][target_qq] = {"user_id": user_id, "display_name": f"{sender_nickname}({user_id})"}
-                            if user_id not in group_data["used"]:
-                                group_data["used"].append(user_id)
-                            if target_qq not in group_data["used"]:
-                                group_data["used"].append(target_qq)
-                            self._save_pair_data()
-                            partner_info = group_data["pairs"][user_id]
-                            formatted_info = self._format_display_info(partner_info['display_name'])
-                            self.advanced_usage[group_id][user_id]["wish"] += 1
-                            message_elements = [Plain(f"💖 许愿成功,系统已为您指定：{formatted_info}作为伴侣\n(请好好对待TA)")]
-                        
-                            # 检查是否开启了显示头像
-                            if self.config.get("show_avatar", True):
-                                partner_id = partner_info['user_id']
-                                avatar_size = self.config.get("avatar_size", 100)
-                                avatar_url = f"http://q.qlogo.cn/headimg_dl?dst_uin={partner_id}&spec={avatar_size}"
-
-                                image_to_send = None
-                                try:
-                                    async with aiohttp.ClientSession() as session:
-                                        async with session.get(avatar_url, timeout=10) as resp:
-                                            if resp.status == 200 and 'image' in resp.headers.get('Content-Type', ''):
-                                                image_data = await resp.read()
-                                                image_to_send = Image.fromBytes(image_data)
-                                            else:
-                                                print(f"下载头像失败或获取到非图片内容，状态码: {resp.status}, Content-Type: {resp.headers.get('Content-Type')}")
-                                except aiohttp.ClientError as e:
-                                    print(f"下载头像网络错误: {e}")
-                                except asyncio.TimeoutError:
-                                    print("下载头像超时")
-                                except Exception as e:
-                                    print(f"处理下载头像异常: {traceback.format_exc()}")
-
-                                if image_to_send:
-                                    message_elements.append(image_to_send)
-                                else:
-                                    message_elements.append(Plain("\n[头像获取失败]"))
-
-                            yield event.chain_result(message_elements)
-                            return
-                        else:
-                            print(f"Napcat API 错误 (许愿): {response_data}")
-                            last_error = f"{current_host}: {response_data}"
-                            continue
+        # 多端口尝试
+        with self._metrics.time("stage_seconds", command="wish", stage="napcat_fetch"):
+            member_info, last_error = await self._get_group_member_info(group_id, target_qq, "许愿")
+        if member_info is None:
+            # 所有主机都尝试失败
+            yield event.plain_result(f"❌ 许愿失败：所有Napcat主机都无法找到该用户\n最后错误: {last_error}")
+            return
 
-            except aiohttp.ClientError as e:
-                print(f"连接 Napcat API 失败 (许愿): {e}")
-                last_error = f"{current_host}: {str(e)}"
-                continue
-            except asyncio.TimeoutError:
-                print(f"连接 Napcat API 超时 (许愿)")
-                last_error = f"{current_host}: 超时"
-                continue
-            except Exception as e:
-                print(f"许愿异常: {traceback.format_exc()}")
-                last_error = f"{current_host}: {str(e)}"
-                continue
+        target_nickname = member_info.get("nickname", f"未知用户({target_qq})")
+        sender_nickname = event.get_sender_name()
+        select_start = time.perf_counter()
+        async with self._group_locks.hold(group_id):
+            # 查询目标期间配对数据可能已被其他命令修改，提交前重新校验
+            await self._check_reset(group_id)
+            group_data = self.pair_data[group_id]
+            if group_data.is_paired(user_id):
+                conflict = "❌ 你已经有伴侣了……许愿将不可用"
+            elif group_data.is_paired(target_qq):
+                conflict = "❌ 你许愿的对象已经有伴侣了哦，请改用强娶功能"
+            elif self.advanced_usage.get(group_id, user_id, "wish") >= self.config.get("max_daily_wishes", 1):
+                conflict = "❌ 今日许愿次数已用完。"
+            else:
+                conflict = None
+                group_data.pair(user_id, sender_nickname, target_qq, target_nickname)
+                self._record_pair_change(group_id, [user_id, target_qq])
+                self.advanced_usage.incr(group_id, user_id, "wish")
+                self._save_advanced_usage(group_id)
+        self._metrics.observe("stage_seconds", time.perf_counter() - select_start, command="wish", stage="selection")
+        if conflict:
+            yield event.plain_result(conflict)
+            return
+        partner_info = group_data.partner(user_id)
+        formatted_info = self._format_member(partner_info.name, partner_info.partner)
+        message_elements = [Plain(f"💖 许愿成功,系统已为您指定：{formatted_info}作为伴侣\n(请好好对待TA)")]
+
+        # 检查是否开启了显示头像
+        if self.config.get("show_avatar", True):
+            partner_id = str(partner_info.partner)
+            with self._metrics.time("stage_seconds", command="wish", stage="avatar"):
+                image_to_send = await self._download_avatar(partner_id)
+
+            if image_to_send:
+                message_elements.append(image_to_send)
+            else:
+                message_elements.append(Plain("\n[头像获取失败]"))
 
-    # 所有主机都尝试失败
-        yield event.plain_result(f"❌ 许愿失败：所有Napcat主机都无法找到该用户\n最后错误: {last_error}")
+        with self._metrics.time("stage_seconds", command="wish", stage="reply"):
+            yield event.chain_result(message_elements)
 
     @filter.command("强娶")
+    @instrumented("rob")
     async def rob_command(self, event: AiocqhttpMessageEvent, input_id: int | None = None):
         group_id = str(event.message_obj.group_id)
         user_id = str(event.get_sender_id())
@@ -822,7 +2978,7 @@ class DailyWifePlugin(Star):
         if target_qq is None:
             target_qq = str(input_id)
 
-        if target_qq is None:
+        if not target_qq.isdigit():
             yield event.plain_result("❌ 参数错误：请@或直接跟QQ号指定目标。")
             return
 
@@ -830,193 +2986,161 @@ class DailyWifePlugin(Star):
             yield event.plain_result("❌ 无法对自己使用强娶功能。")
             return
 
-        self._init_advanced_usage(group_id, user_id)
-        if self.advanced_usage[group_id][user_id]["rob"] >= self.config.get("max_daily_rob_attempts", 2):
+        await self._check_reset(group_id)
+        if self.advanced_usage.get(group_id, user_id, "rob") >= self.config.get("max_daily_rob_attempts", 2):
             yield event.plain_result("❌ 今日强娶次数已用完。")
             return
 
-        if group_id not in self.pair_data:
-            self.pair_data[group_id] = {"date": datetime.now().strftime("%Y-%m-%d"), "pairs": {}, "used": []}
         group_data = self.pair_data[group_id]
 
-        if user_id in group_data["pairs"]:
+        if group_data.is_paired(user_id):
             yield event.plain_result("❌ 你已经有伴侣了……强娶将不可用")
             return
 
         # 多端口尝试
-        last_error = None
-        for attempt in range(len(self.napcat_hosts)):
-            current_host = self._get_current_napcat_host()
-            try:
-                print(f"🔍 强娶功能使用主机: {current_host}")
-            
-                payload = {
-                    "group_id": group_id,
-                    "user_id": target_qq,
-                    "no_cache": False
-                }
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"http://{current_host}/get_group_member_info",
-                        json=payload,
-                        timeout=self.timeout
-                    ) as resp:
-                        response_data = await resp.json()
-                    
-                        if response_data.get("status") == "failed" and "不存在" in response_data.get("message", ""):
-                            print(f"❌ {current_host} 报告用户不存在，尝试下一个主机")
-                            last_error = f"{current_host}: {response_data.get('message')}"
-                            continue
-                    
-                        elif response_data.get("status") == "ok" and "data" in response_data:
-                            target_nickname = response_data["data"].get("nickname", f"未知用户({target_qq})")
-                            if target_qq not in group_data["pairs"]:
-                                yield event.plain_result("❌ 强娶失败：目标当前没有伴侣，请改用许愿命令。")
-                                return
-                            target_pair = group_data["pairs"][target_qq]
-                            if target_pair.get("locked", False):
-                                yield event.plain_result("❌ 强娶失败：目标伴侣处于锁定状态。")
-                                return
-                            partner_id = target_pair["user_id"]
-                            partner_pair = group_data["pairs"].get(partner_id, {})
-                            if partner_pair.get("locked", False):
-                                yield event.plain_result("❌ 强娶失败：目标伴侣处于锁定状态。")
-                                return
-
-                            # 删除被抢夺者及其原配偶的双向记录
-                            if target_qq in group_data["pairs"]:
-                                original_partner_id = group_data["pairs"][target_qq]["user_id"]
-                                original_partner_info = group_data["pairs"][target_qq]
-                                original_partner_name = self._format_display_info(original_partner_info['display_name'])
-                                del group_data["pairs"][target_qq]
-                                if original_partner_id in group_data["pairs"] and group_data["pairs"][original_partner_id]["user_id"] == target_qq:
-                                    del group_data["pairs"][original_partner_id]
-
-                            sender_nickname = event.get_sender_name()
-                            group_data["pairs"][user_id] = {"user_id": target_qq, "display_name": f"{target_nickname}({target_qq})"}
-                            group_data["pairs"][target_qq] = {"user_id": user_id, "display_name": f"{sender_nickname}({user_id})"}
-                            if user_id not in group_data["used"]:
-                                group_data["used"].append(user_id)
-                            if target_qq not in group_data["used"]:
-                                group_data["used"].append(target_qq)
-                            self._save_pair_data()
-                            self.advanced_usage[group_id][user_id]["rob"] += 1
-                            partner_info = group_data["pairs"][user_id]
-                            formatted_info = self._format_display_info(partner_info['display_name'])
-                        
-                            # 修复：在这里定义 message_elements
-                            message_elements = [Plain(f"🐮 强娶成功,系统已为您牛走了：{original_partner_name}的{formatted_info}作为伴侣")]
-                        
-                            # 检查是否开启了显示头像
-                            if self.config.get("show_avatar", True):
-                                partner_id = partner_info['user_id']
-                                avatar_size = self.config.get("avatar_size", 100)
-                                avatar_url = f"http://q.qlogo.cn/headimg_dl?dst_uin={partner_id}&spec={avatar_size}"
-
-                                image_to_send = None
-                                try:
-                                    async with aiohttp.ClientSession() as session:
-                                        async with session.get(avatar_url, timeout=10) as resp:
-                                            if resp.status == 200 and 'image' in resp.headers.get('Content-Type', ''):
-                                                image_data = await resp.read()
-                                                image_to_send = Image.fromBytes(image_data)
-                                            else:
-                                                print(f"下载头像失败或获取到非图片内容，状态码: {resp.status}, Content-Type: {resp.headers.get('Content-Type')}")
-                                except aiohttp.ClientError as e:
-                                    print(f"下载头像网络错误: {e}")
-                                except asyncio.TimeoutError:
-                                    print("下载头像超时")
-                                except Exception as e:
-                                    print(f"处理下载头像异常: {traceback.format_exc()}")
-
-                                if image_to_send:
-                                    message_elements.append(image_to_send)
-                                else:
-                                    message_elements.append(Plain("\n[头像获取失败]"))
+        with self._metrics.time("stage_seconds", command="rob", stage="napcat_fetch"):
+            member_info, last_error = await self._get_group_member_info(group_id, target_qq, "强娶")
+        if member_info is None:
+            # 所有主机都尝试失败
+            yield event.plain_result(f"❌ 强娶失败：所有Napcat主机都无法找到该用户\n最后错误: {last_error}")
+            return
 
-                            yield event.chain_result(message_elements)
-                            return
-                        else:
-                            print(f"Napcat API 错误 (强娶): {response_data}")
-                            last_error = f"{current_host}: {response_data}"
-                            continue
+        target_nickname = member_info.get("nickname", f"未知用户({target_qq})")
+        sender_nickname = event.get_sender_name()
+        select_start = time.perf_counter()
+        async with self._group_locks.hold(group_id):
+            # 查询目标期间配对数据可能已被其他命令修改，提交前重新校验
+            await self._check_reset(group_id)
+            group_data = self.pair_data[group_id]
+            target_pair = group_data.partner(target_qq)
+            if group_data.is_paired(user_id):
+                conflict = "❌ 你已经有伴侣了……强娶将不可用"
+            elif self.advanced_usage.get(group_id, user_id, "rob") >= self.config.get("max_daily_rob_attempts", 2):
+                conflict = "❌ 今日强娶次数已用完。"
+            elif target_pair is None:
+                conflict = "❌ 强娶失败：目标当前没有伴侣，请改用许愿命令。"
+            elif target_pair.locked or getattr(group_data.partner(target_pair.partner), "locked", False):
+                conflict = "❌ 强娶失败：目标伴侣处于锁定状态。"
+            else:
+                conflict = None
+                # 删除被抢夺者及其原配偶的双向记录
+                original_partner_id = str(target_pair.partner)
+                original_partner_name = self._format_member(target_pair.name, target_pair.partner)
+                group_data.unpair(target_qq)
+                group_data.pair(user_id, sender_nickname, target_qq, target_nickname)
+                self._record_pair_change(group_id, [user_id, target_qq, original_partner_id])
+                self.advanced_usage.incr(group_id, user_id, "rob")
+                self._save_advanced_usage(group_id)
+        self._metrics.observe("stage_seconds", time.perf_counter() - select_start, command="rob", stage="selection")
+        if conflict:
+            yield event.plain_result(conflict)
+            return
+        partner_info = group_data.partner(user_id)
+        formatted_info = self._format_member(partner_info.name, partner_info.partner)
 
-            except aiohttp.ClientError as e:
-                print(f"连接 Napcat API 失败 (强娶): {e}")
-                last_error = f"{current_host}: {str(e)}"
-                continue
-            except asyncio.TimeoutError:
-                print(f"连接 Napcat API 超时 (强娶)")
-                last_error = f"{current_host}: 超时"
-                continue
-            except Exception as e:
-                print(f"强娶异常: {traceback.format_exc()}")
-                last_error = f"{current_host}: {str(e)}"
-                continue
+        # 修复：在这里定义 message_elements
+        message_elements = [Plain(f"🐮 强娶成功,系统已为您牛走了：{original_partner_name}的{formatted_info}作为伴侣")]
 
-        # 所有主机都尝试失败
-        yield event.plain_result(f"❌ 强娶失败：所有Napcat主机都无法找到该用户\n最后错误: {last_error}")
+        # 检查是否开启了显示头像
+        if self.config.get("show_avatar", True):
+            partner_id = str(partner_info.partner)
+            with self._metrics.time("stage_seconds", command="rob", stage="avatar"):
+                image_to_send = await self._download_avatar(partner_id)
+
+            if image_to_send:
+                message_elements.append(image_to_send)
+            else:
+                message_elements.append(Plain("\n[头像获取失败]"))
+
+        with self._metrics.time("stage_seconds", command="rob", stage="reply"):
+            yield event.chain_result(message_elements)
 
     @filter.command("锁定")
+    @instrumented("lock")
     async def lock_command(self, event: AstrMessageEvent):
         group_id = str(event.message_obj.group_id)
         if not self._is_advanced_enabled(group_id):
             yield event.plain_result("进阶功能未开启，该群无法使用锁定功能。")
             return
         user_id = event.get_sender_id()
-        self._init_advanced_usage(group_id, user_id)
-        if self.advanced_usage[group_id][user_id]["lock"] >= self.config.get("max_daily_lock", 1):
+        await self._check_reset(group_id)
+        if self.advanced_usage.get(group_id, user_id, "lock") >= self.config.get("max_daily_lock", 1):
             yield event.plain_result("❌ 今日锁定次数已用完。")
             return
-        group_data = self.pair_data.get(group_id, {"pairs": {}, "used": []})
-        if user_id not in group_data["pairs"]:
+        group_data = self.pair_data[group_id]
+        pair_info = group_data.partner(user_id)
+        if pair_info is None:
             yield event.plain_result("锁定失败：你当前没有伴侣。")
             return
-        pair_info = group_data["pairs"][user_id]
-        if pair_info.get("is_initiator", False):
+        if pair_info.is_initiator:
             yield event.plain_result("锁定失败：只有被抽方才能锁定。")
             return
-        partner_id = pair_info["user_id"]
-        group_data["pairs"][user_id]["locked"] = True
-        if partner_id in group_data["pairs"]:
-            group_data["pairs"][partner_id]["locked"] = True
-        self.pair_data[group_id] = group_data
-        self._save_pair_data()
-        self.advanced_usage[group_id][user_id]["lock"] += 1
+        partner_id = pair_info.partner
+        pair_info.locked = True
+        partner_info = group_data.partner(partner_id)
+        if partner_info is not None:
+            partner_info.locked = True
+        self._record_pair_change(group_id, [user_id, partner_id])
+        self.advanced_usage.incr(group_id, user_id, "lock")
+        self._save_advanced_usage(group_id)
         yield event.plain_result("锁定成功，你与伴侣已被锁定，强娶将无法进行。")
 
-    # 异步定时任务检查进阶功能开启是否超时
-    async def _check_advanced_enable_timeout(self):
-        while True:
-            await asyncio.sleep(5)  # 每隔5秒检查一次
-            now = time.time()
-            expired_users = []
-            for user_id, state in DailyWifePlugin.ADVANCED_ENABLE_STATES.items():
-                if now - state["timestamp"] > 30:
-                    expired_users.append(user_id)
-                    # 发送超时消息
-                    await self.context.send_message(state["session"], MessageChain([Plain("开启进阶功能超时了哦~")]))
-
-            # 移除超时的用户状态
-            for user_id in expired_users:
-                if user_id in DailyWifePlugin.ADVANCED_ENABLE_STATES:
-                    del DailyWifePlugin.ADVANCED_ENABLE_STATES[user_id]
+    def _pop_advanced_enable(self, key: Tuple[str, str]) -> Optional[Dict[str, any]]:
+        state = DailyWifePlugin.ADVANCED_ENABLE_STATES.pop(key, None)
+        if state is not None:
+            pending = DailyWifePlugin.ADVANCED_PENDING_GROUPS
+            pending[key[0]] -= 1
+            if pending[key[0]] <= 0:
+                del pending[key[0]]
+        return state
+
+    def _cancel_advanced_enable(self, key: Tuple[str, str]):
+        state = self._pop_advanced_enable(key)
+        if state is not None:
+            state["timer"].cancel()
+
+    def _on_advanced_enable_timeout(self, key: Tuple[str, str]):
+        state = self._pop_advanced_enable(key)
+        if state is None:
+            return
+        # 定时回调不能 await，发送超时消息交给单独的任务
+        asyncio.create_task(self._send_advanced_enable_timeout(state["session"]))
+
+    async def _send_advanced_enable_timeout(self, session):
+        try:
+            await self.context.send_message(session, MessageChain([Plain("开启进阶功能超时了哦~")]))
+        except Exception as e:
+            print(f"发送超时提示失败: {traceback.format_exc()}")
 
     # --------------- 辅助功能 ---------------
     def _clean_invalid_cooling_records(self):
         try:
-            now = datetime.now()
+            now = self._now()
             expired_keys = [ k for k, v in self.cooling_data.items() if v["expire_time"] < now ]
+            lifted = False
             for k in expired_keys:
                 del self.cooling_data[k]
+                # 只有分手过多导致的临时屏蔽带有 block_ 记录，随记录一起到期；手动屏蔽不受影响
+                if k.startswith("block_") and k[len("block_"):] in self.blocked_users:
+                    self.blocked_users.discard(k[len("block_"):])
+                    lifted = True
             if expired_keys:
                 self._save_cooling_data()
+            if lifted:
+                self._save_blocked_users()
         except Exception as e:
             print(f"清理冷静期数据失败: {traceback.format_exc()}")
 
-    def _is_in_cooling_period(self, user1: str, user2: str) -> bool:
-        return any({user1, user2} == set(pair["users"]) and datetime.now() < pair["expire_time"]
-                   for pair in self.cooling_data.values())
+    def _rebuild_cooling_index(self):
+        self._cooling_index = CoolingIndex(self._now)
+        for record in self.cooling_data.values():
+            if len(record["users"]) == 2:
+                self._cooling_index.add(record["users"][0], record["users"][1], record["expire_time"])
+
+    def _add_cooling_record(self, key: str, users: List[str], expire_time: datetime):
+        self.cooling_data[key] = {"users": users, "expire_time": expire_time}
+        if len(users) == 2:
+            self._cooling_index.add(users[0], users[1], expire_time)
 
     # --------------- 动态菜单 ---------------
     @filter.command("老婆菜单")
@@ -1056,6 +3180,10 @@ class DailyWifePlugin(Star):
                     "/重置 -e → 进阶功能状态重置\n"
                     "/屏蔽 [QQ号] - 屏蔽指定用户\n"
                     "/冷静期 [小时] - 设置冷静期时长\n"
+                    "/刷新群成员 [群号/-a] - 清除群成员缓存\n"
+                    "/全群配对 [页码] - 为本群所有单身成员一次性配对（带页码时查看结果）\n"
+                    "/Napcat状态 - 查看Napcat主机健康状态\n"
+                    "/老婆插件统计 - 查看命令耗时、Napcat错误与缓存命中率\n"
                     "/开启老婆插件进阶功能\n\n"
                 )
             else:
@@ -1080,6 +3208,10 @@ class DailyWifePlugin(Star):
                     "/重置 -e → 进阶功能状态重置\n"
                     "/屏蔽 [QQ号] - 屏蔽指定用户\n"
                     "/冷静期 [小时] - 设置冷静期时长\n"
+                    "/刷新群成员 [群号/-a] - 清除群成员缓存\n"
+                    "/全群配对 [页码] - 为本群所有单身成员一次性配对（带页码时查看结果）\n"
+                    "/Napcat状态 - 查看Napcat主机健康状态\n"
+                    "/老婆插件统计 - 查看命令耗时、Napcat错误与缓存命中率\n"
                     "/关闭进阶老婆插件功能\n\n"
                 )
                 menu_text = base_menu + adv_menu + admin_menu + config_menu
@@ -1090,27 +3222,64 @@ class DailyWifePlugin(Star):
     # --------------- 定时任务 ---------------
     async def _daily_reset_task(self):
         while True:
-            now = datetime.now()
-            next_day = now + timedelta(days=1)
-            reset_time = datetime(next_day.year, next_day.month, next_day.day, 0, 0, 5)
-            wait_seconds = (reset_time - now).total_seconds()
-            await asyncio.sleep(wait_seconds)
-            try:
-                yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-                if yesterday in self.breakup_counts:
-                    del self.breakup_counts[yesterday]
-                    self._save_data(BREAKUP_COUNT_PATH, self.breakup_counts)
-                now = datetime.now()
-                self.cooling_data = { k: v for k, v in self.cooling_data.items() if not (k.startswith("block_") and v["expire_time"] < now) }
-                self._save_cooling_data()
-                self._clean_invalid_cooling_records()
-                self.advanced_usage = {}
-            except Exception as e:
-                print(f"定时任务失败: {traceback.format_exc()}")
+            # 多等 1 秒，避免计时误差导致在午夜前被唤醒
+            await asyncio.sleep(max(self._next_rollover_ts - time.time(), 0) + 1)
+            self._daily_rollover()
+
+    def _daily_rollover(self):
+        """跨天批量重置：清空旧日期的配对、分手计数、过期冷静期/临时屏蔽及进阶功能使用次数"""
+        now = datetime.now(self._tz)
+        today = now.strftime("%Y-%m-%d")
+        next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=self._tz)
+        self._next_rollover_ts = next_midnight.timestamp()
+        if today == self._today:
+            return
+        self._today = today
+        try:
+            stale_groups = [gid for gid, group in self.pair_data.items() if group.date != today]
+            for gid in stale_groups:
+                del self.pair_data[gid]
+            if stale_groups:
+                if self._shards is not None:
+                    for gid in stale_groups:
+                        self._mark_group_dirty(gid)
+                else:
+                    # 所有群合并为一次快照写入
+                    self._request_pair_snapshot()
+                self._matcher.invalidate()
+            if self._shards is not None:
+                # 未载入内存的旧分片由后台写入器按修改时间清理，载入时也会按日期丢弃
+                self._shard_prune_before = datetime.combine(now.date(), datetime.min.time(), tzinfo=self._tz).timestamp()
+                self._persister.mark_dirty("pairs")
+            if self.breakup_counts.evict(today):
+                self._save_breakup_counts()
+            self._clean_invalid_cooling_records()
+            if self.advanced_usage.date != today:
+                self.advanced_usage.reset(today)
+                self._save_advanced_usage()
+            print(f"🌙 已切换到 {today}，重置了 {len(stale_groups)} 个群的配对数据")
+        except Exception as e:
+            print(f"跨天重置失败: {traceback.format_exc()}")
 
     # 插件被禁用、重载或关闭时触发
     async def terminate(self):
         """
         此处实现你的对应逻辑, 例如销毁, 释放某些资源, 回滚某些修改。
         """
-        pass
+        # 停止后台写入器，并保证所有未落盘的数据写入完成
+        self._rollover_task.cancel()
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+        if self._avatar_sweep_task is not None:
+            self._avatar_sweep_task.cancel()
+        for key in list(DailyWifePlugin.ADVANCED_ENABLE_STATES):
+            self._cancel_advanced_enable(key)
+        await self._persister.close()
+        if self._sqlite is not None:
+            self._sqlite.close()
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()